@@ -0,0 +1,5 @@
+from .pool import WorkerPool, WorkerCrashedError
+from .consumer import PoolConsumer
+from .scheduler import FairShareScheduler, ScheduledPoolConsumer
+
+__all__ = ['WorkerPool', 'WorkerCrashedError', 'PoolConsumer', 'FairShareScheduler', 'ScheduledPoolConsumer']
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from signal import SIGINT, SIGTERM
+
+import aio_pika
+from sentry_sdk import capture_exception
+
+logger = logging.getLogger('runner')
+
+
+async def run_streamed(*args):
+    """Runs a command and logs its output line by line while it's running. Returns its exit code."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    async for line in process.stdout:
+        logger.debug("[%s] %s" % (args[0], line.decode(errors='replace').rstrip()))
+    return await process.wait()
+
+
+class AsyncConsumer:
+    """
+    Consumes a queue on an asyncio event loop, so the connection keeps up with the broker's heartbeats no matter how
+    long the jobs take.
+
+    `handler` is given the body of each message. It's run in `pool` (a `WorkerPool`) if one is given, or awaited on
+    the loop otherwise. At most `concurrency` messages are processed at the same time, each one is acked after its
+    job is done and messages are deduplicated by `dedupe_key`, like `PoolConsumer`. `on_result` and `on_error` are run
+    in a thread of the loop's default executor, since they're blocking (like the Django ORM, which refuses to run on the
+    loop's thread).
+    """
+
+    def __init__(self, url, queue_name, handler, concurrency, pool=None, on_result=None, on_error=None,
+                 dedupe_key=None):
+        self.url = url
+        self.queue_name = queue_name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.pool = pool
+        self.on_result = on_result
+        self.on_error = on_error
+        self.dedupe_key = dedupe_key
+
+        self._connection = None
+        self._queue = None
+        self._consumer_tag = None
+        self._tasks = set()
+        self._keys = set()
+
+    async def start(self):
+        self._connection = await aio_pika.connect_robust(self.url)
+        channel = await self._connection.channel()
+        await channel.set_qos(prefetch_count=self.concurrency)
+
+        self._queue = await channel.declare_queue(self.queue_name, durable=True)
+        self._consumer_tag = await self._queue.consume(self._handle_new_message)
+
+        logger.info('Waiting on messages from queue "%s"...' % self.queue_name)
+
+    async def stop(self):
+        """Stops taking new messages and waits for the ones being processed before closing the connection."""
+        if self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+
+        if self._tasks:
+            logger.info('Waiting for %d jobs of queue "%s" to finish...' % (len(self._tasks), self.queue_name))
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def _handle_new_message(self, message):
+        try:
+            key = self.dedupe_key(message.body) if self.dedupe_key is not None else None
+        except Exception as e:
+            capture_exception(e)
+            logger.error("Could not read the key of message, rejecting it: %s" % str(e))
+            await message.reject(requeue=False)
+            return
+        if key is not None:
+            if key in self._keys:
+                logger.info("Dropping message %s since it's already being processed..." % str(key))
+                await message.ack()
+                return
+            self._keys.add(key)
+
+        task = asyncio.create_task(self._process(message, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, message, key):
+        loop = asyncio.get_running_loop()
+        try:
+            if self.pool is not None:
+                result = await asyncio.wrap_future(self.pool.submit(self.handler, message.body))
+            else:
+                result = await self.handler(message.body)
+        except Exception as e:
+            capture_exception(e)
+            logger.error("Worker failed to process message: %s" % str(e))
+
+            if self.on_error is not None:
+                try:
+                    await loop.run_in_executor(None, self.on_error, message.body, e)
+                except Exception:
+                    capture_exception()
+        else:
+            if self.on_result is not None:
+                try:
+                    await loop.run_in_executor(None, self.on_result, result)
+                except Exception:
+                    capture_exception()
+        finally:
+            self._keys.discard(key)
+
+        await message.ack()
+
+
+async def run_consumers(*consumers):
+    """Runs the consumers until a SIGTERM or SIGINT, and then lets their in-flight jobs finish before returning."""
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signal in (SIGTERM, SIGINT):
+        loop.add_signal_handler(signal, stopping.set)
+
+    for consumer in consumers:
+        await consumer.start()
+
+    await stopping.wait()
+    logger.info("Shutting down gracefully...")
+
+    await asyncio.gather(*(consumer.stop() for consumer in consumers))
@@ -0,0 +1,212 @@
+import io
+import logging
+import tarfile
+from collections import deque
+from re import DOTALL, compile, match, sub
+from subprocess import DEVNULL, Popen, PIPE, STDOUT
+from threading import Thread
+
+logger = logging.getLogger('runner')
+
+DOCKERFILE_SYNTAX = '# syntax=docker/dockerfile:1.4'
+
+# Errors of BuildKit that mean the instructions of the build failed, which they would with repo2docker too
+BUILD_ERROR_PATTERN = compile(
+    r'did not complete successfully|executor failed running|dockerfile parse error|failed to compute cache key'
+)
+
+
+class BuildError(ChildProcessError):
+    """Raised when the build fails because of the code that's being built, rather than because of BuildKit."""
+
+
+class CacheMount:
+    """A BuildKit cache mount that `RUN` instructions running the matching commands get."""
+
+    def __init__(self, name, pattern, target, root_only=False, sharing='shared', strip=(), setup=None,
+                 per_image=False):
+        self.name = name
+        self.pattern = compile(pattern, DOTALL)
+        self.target = target  # Formatted with the home directory of the user of the instruction
+        self.root_only = root_only
+        self.sharing = sharing
+        # Parts of the commands that only make sense when the cache is thrown away with the layer
+        self.strip = [compile(pattern) for pattern in strip]
+        self.setup = setup  # Run before the commands, to keep the package manager from emptying the cache itself
+        self.per_image = per_image  # Whether each base image gets its own cache, like compilers whose output differs
+
+    def render(self, home, uid, base_image):
+        cache_id = 'packman-' + self.name
+        if self.per_image:
+            cache_id += '-' + sub(r'[^\w.-]', '-', base_image)
+        # The owner of a cache is only set when it's created, so builds as another user couldn't write to it
+        cache_id += '-%d' % uid
+        return '--mount=type=cache,id=%s,target=%s,uid=%d,gid=%d,sharing=%s' % (
+            cache_id, self.target.format(home=home), uid, uid, self.sharing
+        )
+
+
+CACHE_MOUNTS = (
+    CacheMount(
+        'apt', r'\bapt-get\b.*\binstall\b', '/var/cache/apt', root_only=True, sharing='locked',
+        strip=(r'apt-get -qq clean &&', r'&& apt-get -qq clean\b'), setup='rm -f /etc/apt/apt.conf.d/docker-clean'
+    ),
+    CacheMount('pip', r'\bpip3?\b.*\binstall\b', '{home}/.cache/pip', strip=(r' --no-cache-dir\b',)),
+    CacheMount(
+        'conda', r'(\bconda|\bmamba|MAMBA_EXE\})\s.*\b(install|create|update)\b', '/srv/conda/pkgs',
+        strip=(r'time \$\{\{?MAMBA_EXE\}\}? clean --all -f -y &&', r'\$\{\{?MAMBA_EXE\}\}? clean --all -f -y &&')
+    ),
+    CacheMount('go-modules', r'\bgo (mod download|get|build)\b', '/go/pkg/mod'),
+    CacheMount('go-build', r'\bgo (get|build)\b', '{home}/.cache/go-build'),
+    CacheMount('ccache', r'\bccache-build\b', '/srv/ccache', per_image=True),
+)
+
+
+def add_cache_mounts(dockerfile, build_args):
+    """
+    Rewrites a Dockerfile rendered by a buildpack, so the package managers it runs keep their downloads in BuildKit
+    cache mounts, which outlive the build, instead of in layers that are thrown away.
+    """
+    user_name = build_args.get('NB_USER')
+    user_id = int(build_args.get('NB_UID', 1000))
+
+    lines = dockerfile.splitlines()
+    output = [DOCKERFILE_SYNTAX]
+
+    is_root = True
+    base_image = ''
+    i = 0
+    while i < len(lines):
+        # Instructions can go on over several lines
+        instruction = [lines[i]]
+        while instruction[-1].rstrip().endswith('\\') and i + 1 < len(lines):
+            i += 1
+            instruction.append(lines[i])
+        i += 1
+
+        text = '\n'.join(instruction)
+        keyword, arguments = match(r'\s*(\S*)\s*(.*)', text, DOTALL).groups()
+        keyword = keyword.upper()
+
+        if keyword == 'FROM':
+            base_image = next((argument for argument in arguments.split() if not argument.startswith('--')), '')
+            is_root = True
+        elif keyword == 'USER':
+            is_root = arguments.strip() in ('root', '0')
+        elif keyword == 'RUN' and not arguments.lstrip().startswith('--mount'):
+            home = '/root' if is_root else '/home/%s' % user_name
+            uid = 0 if is_root else user_id
+
+            mounts = []
+            for mount in CACHE_MOUNTS:
+                if mount.pattern.search(arguments) and (is_root or not mount.root_only):
+                    mounts.append(mount.render(home, uid, base_image))
+                    for pattern in mount.strip:
+                        arguments = pattern.sub('', arguments)
+                    if mount.setup is not None:
+                        arguments = mount.setup + ' && ' + arguments
+
+            if mounts:
+                text = text[:len(text) - len(text.lstrip())] + 'RUN ' + ' '.join(mounts) + ' ' + arguments
+
+        output.append(text)
+
+    return '\n'.join(output) + '\n'
+
+
+class BuildKitClient:
+    """
+    Stands in for the Docker client that repo2docker's buildpacks build with, and builds their context with BuildKit
+    (`docker buildx build`) instead, with cache mounts added to the Dockerfile and the cache exported with the image
+    (and to the registry, if there's a `cache_ref`).
+
+    Like the Docker client, it takes either a context tarball in `fileobj` or a directory in `path` with the Dockerfile
+    in `dockerfile`, which is how the Dockerfile buildpack builds. That Dockerfile is built as the repository has it.
+    """
+
+    def __init__(self, docker_config_dir, cache_ref=None, cache_from=()):
+        self.docker_config_dir = docker_config_dir
+        self.cache_ref = cache_ref
+        self.cache_from = cache_from
+
+    def build(self, tag, buildargs, fileobj=None, path=None, dockerfile=None, labels=None, **kwargs):
+        command = [
+            'docker', '--config', self.docker_config_dir, 'buildx', 'build', '--progress', 'plain', '--load',
+            '--tag', tag,
+            # Keeps the cache metadata in the image itself, so later builds can use it through `cache_from` once it's
+            # pushed, which works with any buildx driver
+            '--build-arg', 'BUILDKIT_INLINE_CACHE=1'
+        ]
+        for name, value in buildargs.items():
+            command += ['--build-arg', '%s=%s' % (name, value)]
+        for name, value in (labels or {}).items():
+            command += ['--label', '%s=%s' % (name, value)]
+        for image_name in self.cache_from:
+            command += ['--cache-from', 'type=registry,ref=' + image_name]
+        if self.cache_ref is not None:
+            command += [
+                '--cache-from', 'type=registry,ref=' + self.cache_ref,
+                '--cache-to', 'type=registry,ref=%s,mode=max' % self.cache_ref
+            ]
+
+        if fileobj is not None:
+            context = rewrite_context(fileobj, buildargs)
+            command.append('-')
+        else:
+            context = None
+            if dockerfile is not None:
+                command += ['--file', dockerfile]
+            command.append(path)
+
+        process = Popen(command, stdin=PIPE if context is not None else DEVNULL, stdout=PIPE, stderr=STDOUT)
+
+        def write_context():
+            try:
+                process.stdin.write(context)
+            finally:
+                process.stdin.close()
+
+        # Write the context while reading the output, or they could block each other
+        writer = Thread(target=write_context, daemon=True)
+        if context is not None:
+            writer.start()
+        last_lines = deque(maxlen=20)
+        for line in process.stdout:
+            line = line.decode(errors='replace')
+            last_lines.append(line)
+            yield {'stream': line}
+        if context is not None:
+            writer.join()
+
+        if process.wait() != 0:
+            yield {
+                'error': "BuildKit build failed with exit code %d!" % process.returncode,
+                'build_error': any(BUILD_ERROR_PATTERN.search(line) for line in last_lines)
+            }
+
+
+def rewrite_context(fileobj, build_args):
+    """Returns the build context tarball with cache mounts added to its Dockerfile."""
+    rewritten = io.BytesIO()
+    with tarfile.open(fileobj=fileobj) as source, tarfile.open(fileobj=rewritten, mode='w') as destination:
+        for member in source:
+            content = source.extractfile(member) if member.isfile() else None
+            if member.name == 'Dockerfile':
+                dockerfile = add_cache_mounts(content.read().decode(), build_args).encode()
+                member.size = len(dockerfile)
+                content = io.BytesIO(dockerfile)
+            destination.addfile(member, content)
+
+    return rewritten.getvalue()
+
+
+def build_with_buildkit(buildpack, image_name, build_args, docker_config_dir, cache_ref=None, cache_from=()):
+    """
+    Builds the repository in the current directory with a buildpack instance through BuildKit. Raises `BuildError` if
+    the build fails because of the repository, or `ChildProcessError` if it fails otherwise.
+    """
+    client = BuildKitClient(docker_config_dir, cache_ref, cache_from)
+    for line in buildpack.build(client, image_name, 0, build_args, list(cache_from), {}):
+        if 'error' in line:
+            raise (BuildError if line.get('build_error') else ChildProcessError)(line['error'])
+        logger.debug(line['stream'].rstrip())
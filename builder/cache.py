@@ -0,0 +1,69 @@
+import logging
+from hashlib import sha256
+
+from requests import RequestException
+
+from .registry import RegistryClient, parse_image_name, read_docker_credentials
+
+logger = logging.getLogger('runner')
+
+
+class BuildCache:
+    """
+    A content-addressed cache of built images, kept in the registry itself.
+
+    Every pushed image is also tagged with a key made from its git tree hash, the buildpack that built it, its runtime
+    and the hash of its build recipe (see `hash_build_recipe`). When another build of the same repository has the same
+    key, the cached manifest is simply tagged with the new image name, so nothing is built or uploaded again.
+    """
+    TAG_PREFIX = 'build-cache-'
+
+    def __init__(self, docker_config_dir, scheme='https'):
+        self.docker_config_dir = docker_config_dir
+        self.scheme = scheme
+        self._clients = {}
+
+    @staticmethod
+    def key(tree_hash, buildpack, runtime=None, recipe_hash=''):
+        buildpack_name = '.'.join((buildpack.__module__, buildpack.__qualname__))
+        return sha256('\0'.join((tree_hash, buildpack_name, runtime or '', recipe_hash)).encode()).hexdigest()
+
+    def restore(self, key, image_name):
+        """Tags the cached image of `key` as `image_name` in the registry. Returns whether there was one."""
+        host, repository, tag = parse_image_name(image_name)
+        try:
+            restored = self._get_client(host).tag(repository, self.TAG_PREFIX + key, tag)
+        except RequestException as e:
+            # The registry being unreachable at this point only means that the image has to be built
+            logger.warning("Could not look up build %s in the build cache: %s" % (key, str(e)))
+            return False
+
+        if restored:
+            logger.info("Reused the cached image of build %s for %s." % (key, image_name))
+        return restored
+
+    def store(self, key, image_name):
+        """Makes the already pushed `image_name` available for future builds with the same key."""
+        host, repository, tag = parse_image_name(image_name)
+        self._get_client(host).tag(repository, tag, self.TAG_PREFIX + key)
+
+    def _get_client(self, host):
+        if host not in self._clients:
+            self._clients[host] = RegistryClient(
+                host, read_docker_credentials(self.docker_config_dir, host), self.scheme
+            )
+        return self._clients[host]
+
+
+def hash_build_recipe(buildpack, build_args):
+    """
+    Hashes what a buildpack instance builds the repository in the current directory with: its rendered Dockerfile and
+    the contents of the files its build scripts copy into the image. Settings of the builder that change the image,
+    like the wheelhouse, end up in one of them.
+    """
+    digest = sha256(buildpack.render(build_args).encode())
+    for src in sorted(buildpack.get_build_script_files()):
+        _, src_path = buildpack.generate_build_context_filename(src)
+        with open(src_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
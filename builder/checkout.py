@@ -0,0 +1,19 @@
+from subprocess import run, PIPE
+
+
+def git(*args, cwd=None):
+    process = run(('git',) + args, cwd=cwd, stdout=PIPE, stderr=PIPE, text=True)
+    if process.returncode != 0:
+        raise ChildProcessError("git %s failed: %s" % (args[0], process.stderr.strip()))
+    return process.stdout.strip()
+
+
+def checkout_repository(url, reference, path):
+    """Clones the repository at `url` into `path` and checks out `reference` there."""
+    git('clone', '--quiet', '--no-checkout', url, path)
+    git('checkout', '--quiet', '--detach', reference, cwd=path)
+
+
+def get_tree_hash(path, reference='HEAD'):
+    """Returns the hash of the git tree of `reference`, which only depends on the content of the files."""
+    return git('rev-parse', reference + '^{tree}', cwd=path)
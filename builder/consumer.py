@@ -0,0 +1,122 @@
+import logging
+from functools import partial
+from time import sleep
+
+from pika import BlockingConnection, URLParameters
+from pika.exceptions import AMQPConnectionError, ChannelClosed, ConnectionClosed
+from sentry_sdk import capture_exception
+
+logger = logging.getLogger('runner')
+
+RECONNECT_DELAY = 5
+
+
+class PoolConsumer:
+    """
+    Consumes a queue and hands every message to a `WorkerPool` instead of processing it in the consumer thread.
+
+    The consumer has its own connection to the broker at `url`, on which the prefetch is bounded to the size of the pool
+    before anything is consumed. Each message is acked only after its job has finished, so unfinished builds are
+    redelivered if the consumer goes away. The consumer reconnects whenever its connection is lost.
+
+    If `dedupe_key` is given, it's called with the body of each message and a message whose key (other than `None`)
+    is already being processed is acked without being processed again. The keys of the jobs that are still running
+    are kept when the consumer reconnects, since that's when the broker delivers their messages again. A message whose
+    key can't be read is rejected.
+    """
+
+    def __init__(self, url, queue_name, pool, handler, on_result=None, on_error=None, dedupe_key=None):
+        self.url = url
+        self.queue_name = queue_name
+        self.pool = pool
+        self.handler = handler
+        self.on_result = on_result
+        self.on_error = on_error
+        self.dedupe_key = dedupe_key
+
+        # Dedupe keys of the messages being processed, only added in the consumer thread and removed by the pool
+        self._keys = set()
+
+    def start(self):
+        """Consumes the queue until the process exits."""
+        while True:
+            try:
+                self._consume()
+            except (AMQPConnectionError, ConnectionClosed, ChannelClosed) as e:
+                capture_exception(e)
+                logger.warning('Lost the connection to queue "%s" (%s), reconnecting...' % (self.queue_name, str(e)))
+                sleep(RECONNECT_DELAY)
+
+    def _consume(self):
+        connection = BlockingConnection(URLParameters(self.url))
+        # Delivery tags start over on the new channel, and the messages of the old one are delivered again
+        self._reset()
+        try:
+            channel = connection.channel()
+            channel.queue_declare(self.queue_name, durable=True)
+            # The prefetch has to be bounded before consuming, or the broker sends every message it has right away
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+            channel.basic_consume(self.queue_name, self.handle_new_message)
+            channel.start_consuming()
+        finally:
+            if connection.is_open:
+                connection.close()
+
+    @property
+    def prefetch_count(self):
+        return self.pool.size
+
+    def _reset(self):
+        """Called before consuming on a new channel, whose delivery tags start over."""
+
+    def handle_new_message(self, channel, method_frame, header_frame, body):
+        delivery_tag = method_frame.delivery_tag
+        try:
+            key = self.dedupe_key(body) if self.dedupe_key is not None else None
+        except Exception as e:
+            capture_exception(e)
+            logger.error("Could not read the key of message, rejecting it: %s" % str(e))
+            channel.basic_reject(delivery_tag, requeue=False)
+            return
+        if key is not None:
+            if key in self._keys:
+                logger.info("Dropping message %s since it's already being processed..." % str(key))
+                channel.basic_ack(delivery_tag)
+                return
+            self._keys.add(key)
+
+        self._submit(channel, delivery_tag, body, key)
+
+    def _submit(self, channel, delivery_tag, body, key):
+        future = self.pool.submit(self.handler, body)
+        future.add_done_callback(partial(self._job_done, channel, delivery_tag, body, key))
+
+    def _finish(self, channel, delivery_tag):
+        """Called in the consumer thread after the job of a message is done."""
+        # If the channel is gone, the broker has already given the message to another consumer
+        if channel.is_open:
+            channel.basic_ack(delivery_tag)
+
+    def _job_done(self, channel, delivery_tag, body, key, future):
+        # Jobs of an earlier channel are never finished, but their keys have to be forgotten too
+        self._keys.discard(key)
+
+        exception = future.exception()
+        if exception is not None:
+            capture_exception(exception)
+            logger.error("Worker failed to process message: %s" % str(exception))
+
+            if self.on_error is not None:
+                try:
+                    self.on_error(body, exception)
+                except Exception:
+                    capture_exception()
+        elif self.on_result is not None:
+            try:
+                self.on_result(future.result())
+            except Exception:
+                capture_exception()
+
+        # The connection is not thread-safe, so the ack has to be sent from the consumer thread.
+        if channel.connection.is_open:
+            channel.connection.add_callback_threadsafe(partial(self._finish, channel, delivery_tag))
@@ -0,0 +1,103 @@
+import logging
+from contextlib import contextmanager
+from json import dumps
+from time import perf_counter
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger('runner')
+
+BUILD_PHASE_SECONDS = Histogram(
+    'packman_build_phase_seconds', "Time spent in each phase of building and pushing an image.",
+    ('phase', 'buildpack', 'problem'),
+    buckets=(.01, .05, .1, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+
+PUSHED_BYTES = Counter(
+    'packman_pushed_bytes', "Bytes of image layers that were uploaded, or skipped since the registry had them.",
+    ('result',)
+)
+
+SCHEDULER_DISPATCHED = Counter(
+    'packman_scheduler_dispatched', "Build jobs handed to the workers by the scheduler.", ('lane', 'problem')
+)
+SCHEDULER_THROTTLED = Counter(
+    'packman_scheduler_throttled', "Times a waiting build job was held back by the concurrency limit of its team."
+)
+SCHEDULER_PENDING = Gauge(
+    'packman_scheduler_pending_jobs', "Build jobs waiting in the scheduler for a free worker.", ('problem',)
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    'packman_scheduler_wait_seconds', "Time build jobs wait in the scheduler before being dispatched.", ('lane',),
+    buckets=(.1, .5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+
+
+class BuildTimings:
+    """
+    Collects how long each phase of processing a build message takes.
+
+    Phases can be nested, in which case the time of the inner phase is not counted for the outer one. It is a plain
+    picklable object, so worker processes can send it back to the consumer to be recorded there.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.labels = {'id': None, 'buildpack': 'unknown', 'problem': 'unknown'}
+        self.phases = {}
+        self.outcome = None
+        self.total = None
+        self.pushed_bytes = {}
+
+        self._started_at = perf_counter()
+        self._children_time = []
+
+    @contextmanager
+    def phase(self, name):
+        self._children_time.append(0.)
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started_at
+            children_time = self._children_time.pop()
+            if self._children_time:
+                self._children_time[-1] += elapsed
+
+            self.phases[name] = self.phases.get(name, 0.) + elapsed - children_time
+
+    def set_push_report(self, report):
+        """Keeps how many bytes a push through the registry API uploaded and skipped, if it was one."""
+        if report is not None:
+            self.pushed_bytes = {'pushed': report.bytes_pushed, 'skipped': report.bytes_skipped}
+
+    def finish(self):
+        self.total = perf_counter() - self._started_at
+
+    def summary(self):
+        return {
+            'kind': self.kind,
+            **self.labels,
+            'outcome': self.outcome,
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            **({'pushed_bytes': self.pushed_bytes} if self.pushed_bytes else {}),
+            'total': round(self.total, 3) if self.total is not None else None
+        }
+
+
+def record_build_timings(timings):
+    """Exports the phase timings of a build as metrics and logs a summary record of it."""
+    if timings is None:
+        return
+
+    for phase, seconds in timings.phases.items():
+        BUILD_PHASE_SECONDS.labels(phase, timings.labels['buildpack'], timings.labels['problem']).observe(seconds)
+    for result, size in timings.pushed_bytes.items():
+        PUSHED_BYTES.labels(result).inc(size)
+
+    logger.info("Build summary: %s" % dumps(timings.summary()))
+
+
+def start_metrics_server(port):
+    start_http_server(port)
+    logger.info("Serving metrics on port %d..." % port)
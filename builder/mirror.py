@@ -0,0 +1,154 @@
+import logging
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from os import fstat, makedirs, path, remove, scandir, stat, utime, walk
+from re import fullmatch
+from shutil import rmtree
+
+from .checkout import git, checkout_repository
+
+logger = logging.getLogger('runner')
+
+
+def get_directory_size(directory):
+    return sum(path.getsize(path.join(root, file)) for root, _, files in walk(directory) for file in files)
+
+
+class GitMirrorCache:
+    """
+    Keeps a bare mirror of every built repository, so a build only fetches the commit it needs instead of cloning the
+    whole history again.
+
+    Mirrors are locked while they're being used, so concurrent builds of the same project (even in different
+    processes) don't step on each other. The least recently used mirrors are removed when the total size of the
+    mirrors goes over `max_size` bytes. The size of each mirror is kept next to it and only measured again after a
+    fetch, so builds don't walk all the mirrors.
+    """
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+
+        makedirs(root, exist_ok=True)
+
+    def checkout(self, project_id, url, reference, destination):
+        """
+        Checks out `reference` of the repository of `project_id` into `destination`, fetching it first if needed.
+        Without a reference, the default branch is checked out.
+        """
+        mirror = self._get_mirror_path(project_id)
+        reference = reference or 'HEAD'
+
+        with self._lock(project_id):
+            if not path.exists(mirror):
+                git('init', '--quiet', '--bare', mirror)
+                # Keep fetched objects in packs instead of spreading them over thousands of loose object files
+                git('config', 'transfer.unpackLimit', '1', cwd=mirror)
+
+            commit = self._resolve(mirror, reference) if fullmatch(r'[0-9a-f]{40}', reference) else None
+            if commit is None:
+                logger.info("Fetching %s of project %d into its mirror..." % (reference, project_id))
+                try:
+                    git('fetch', '--quiet', '--no-tags', url, reference, cwd=mirror)
+                    commit = git('rev-parse', 'FETCH_HEAD^{commit}', cwd=mirror)
+                except ChildProcessError:
+                    # Some servers don't allow fetching a commit by its hash, so fall back to fetching all branches
+                    git('fetch', '--quiet', '--no-tags', url, '+refs/heads/*:refs/heads/*', cwd=mirror)
+                    commit = self._resolve(mirror, reference)
+                    if commit is None:
+                        raise
+
+                # Keep a ref to the fetched commit, so it's not garbage collected
+                git('update-ref', 'refs/packman/' + commit, commit, cwd=mirror)
+                git('gc', '--auto', '--quiet', cwd=mirror)
+
+                self._write_size(project_id, get_directory_size(mirror))
+
+            # A local clone hard-links the objects of the mirror, so it's cheap and independent of the mirror afterwards
+            checkout_repository(mirror, commit, destination)
+
+            # The modification time of a mirror marks its last use
+            utime(mirror)
+
+        self.evict(keep=mirror)
+
+    def evict(self, keep=None):
+        """Removes the least recently used mirrors until the cache fits in its size limit."""
+        mirrors = sorted(
+            (entry for entry in scandir(self.root) if entry.is_dir() and entry.path != keep),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        sizes = {entry.path: self._read_size(entry.path) for entry in mirrors}
+        total_size = sum(sizes.values()) + (self._read_size(keep) if keep else 0)
+
+        for entry in mirrors:
+            if total_size <= self.max_size:
+                break
+
+            project_id = int(entry.name.split('.')[0])
+            with self._lock(project_id, blocking=False) as locked:
+                if not locked:  # It's being used right now
+                    continue
+
+                logger.info("Evicting mirror of project %d from the cache..." % project_id)
+                rmtree(entry.path, ignore_errors=True)
+                for file in (self._get_size_path(project_id), self._get_lock_path(project_id)):
+                    try:
+                        remove(file)
+                    except FileNotFoundError:
+                        pass
+                total_size -= sizes[entry.path]
+
+    def _get_mirror_path(self, project_id):
+        return path.join(self.root, '%d.git' % project_id)
+
+    def _get_size_path(self, project_id):
+        return path.join(self.root, '%d.size' % project_id)
+
+    def _get_lock_path(self, project_id):
+        return path.join(self.root, '%d.lock' % project_id)
+
+    def _read_size(self, mirror):
+        """Returns the recorded size of a mirror, measuring it if it has never been recorded."""
+        project_id = int(path.basename(mirror).split('.')[0])
+        try:
+            with open(self._get_size_path(project_id)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            size = get_directory_size(mirror)
+            self._write_size(project_id, size)
+            return size
+
+    def _write_size(self, project_id, size):
+        with open(self._get_size_path(project_id), 'w') as f:
+            f.write(str(size))
+
+    @staticmethod
+    def _resolve(mirror, reference):
+        try:
+            return git('rev-parse', '--verify', '--quiet', reference + '^{commit}', cwd=mirror)
+        except ChildProcessError:
+            return None
+
+    @contextmanager
+    def _lock(self, project_id, blocking=True):
+        lock_path = self._get_lock_path(project_id)
+        while True:
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    flock(lock_file, LOCK_EX if blocking else LOCK_EX | LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+
+                try:
+                    # The lock file is removed along with its mirror, so it may not be the one at the path anymore
+                    try:
+                        is_current = path.samestat(fstat(lock_file.fileno()), stat(lock_path))
+                    except FileNotFoundError:
+                        is_current = False
+                    if is_current:
+                        yield True
+                        return
+                finally:
+                    flock(lock_file, LOCK_UN)
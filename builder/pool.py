@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+
+import sentry_sdk
+
+
+class WorkerCrashedError(ChildProcessError):
+    pass
+
+
+def _run_in_child(sender, fn, args):
+    try:
+        result = (True, fn(*args))
+    except BaseException as e:
+        result = (False, e)
+
+    try:
+        sender.send(result)
+    except Exception as e:  # The result or the exception could not be pickled
+        sender.send((False, RuntimeError(repr(e))))
+    finally:
+        # Forked children leave through `os._exit`, so pending Sentry events have to be sent now.
+        sentry_sdk.flush()
+
+
+class WorkerPool:
+    """
+    Runs jobs on at most `size` worker slots at the same time.
+
+    If `isolated` is set, every job is run in a freshly forked process, so a crashing job (segfault, OOM kill, a
+    misbehaving `Repo2Docker` instance, ...) only takes itself down and not the consumer that submitted it.
+    """
+
+    def __init__(self, size, isolated=True, name='worker'):
+        self.size = size
+        self.isolated = isolated
+
+        self._executor = ThreadPoolExecutor(size, thread_name_prefix=name)
+        self._context = get_context('fork')
+
+    def submit(self, fn, *args):
+        if self.isolated:
+            return self._executor.submit(self._run_isolated, fn, *args)
+        return self._executor.submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run_isolated(self, fn, *args):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_in_child, args=(sender, fn, args))
+        process.start()
+        sender.close()
+
+        try:
+            succeeded, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise WorkerCrashedError("Worker process died with exit code %s!" % process.exitcode)
+        finally:
+            receiver.close()
+
+        process.join()
+
+        if not succeeded:
+            raise value
+        return value
@@ -0,0 +1,201 @@
+import gzip
+import logging
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from json import dump, dumps, load, loads
+from os import makedirs, path
+from shutil import copyfileobj
+from subprocess import Popen, DEVNULL
+from tempfile import TemporaryDirectory
+from time import sleep
+
+from requests import RequestException
+
+from .registry import RegistryClient, parse_image_name, read_docker_credentials
+
+logger = logging.getLogger('runner')
+
+MANIFEST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+CONFIG_MEDIA_TYPE = 'application/vnd.docker.container.image.v1+json'
+LAYER_MEDIA_TYPE = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+
+COMPRESS_LEVEL = 6
+
+
+class PushReport:
+    def __init__(self, image_name):
+        self.image_name = image_name
+        self.bytes_pushed = 0
+        self.bytes_skipped = 0  # Blobs that were already in the repository or were mounted from another one
+        self.layers_pushed = 0
+        self.layers_skipped = 0
+        self.layers_mounted = 0
+        self.manifest_skipped = False
+
+    def __str__(self):
+        return "%d layers (%d bytes) pushed, %d skipped and %d mounted (%d bytes)" % (
+            self.layers_pushed, self.bytes_pushed, self.layers_skipped, self.layers_mounted, self.bytes_skipped
+        )
+
+
+class RegistryPusher:
+    """
+    Pushes images to their registry through its HTTP API instead of `docker push`.
+
+    The image is exported with `docker save` and nothing the registry already has is uploaded: the whole push is
+    skipped if the tag already points to the same image, and so is every layer that is already in the repository.
+    Layers that were pushed to another repository before are mounted from there, which is what happens to the base
+    layers that most submissions share. The remaining layers are compressed and uploaded in parallel, with retries.
+
+    Layers are compressed deterministically, and the digests of the compressed layers are remembered in `cache_dir`
+    along with a repository that has them, so a layer is never compressed twice on the same host.
+    """
+
+    def __init__(self, docker_config_dir, cache_dir, workers=4, retries=3, scheme='https'):
+        self.docker_config_dir = docker_config_dir
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.retries = retries
+        self.scheme = scheme
+
+        makedirs(cache_dir, exist_ok=True)
+
+    def push(self, image_name):
+        host, repository, tag = parse_image_name(image_name)
+        client = RegistryClient(host, read_docker_credentials(self.docker_config_dir, host), self.scheme)
+        report = PushReport(image_name)
+
+        with TemporaryDirectory() as directory:
+            image = self._save(image_name, directory)
+            with open(path.join(directory, image['Config']), 'rb') as f:
+                config = f.read()
+            config_digest = 'sha256:' + sha256(config).hexdigest()
+
+            existing_manifest = client.get_manifest(repository, tag)
+            if existing_manifest is not None and get_config_digest(*existing_manifest) == config_digest:
+                report.manifest_skipped = True
+                logger.info("Image %s is already in the registry, skipping the push." % image_name)
+                return report
+
+            diff_ids = loads(config)['rootfs']['diff_ids']
+            with ThreadPoolExecutor(self.workers) as executor:
+                layers = list(executor.map(
+                    lambda args: self._push_layer(client, repository, directory, *args), zip(image['Layers'], diff_ids)
+                ))
+            for _, size, outcome in layers:
+                if outcome == 'pushed':
+                    report.layers_pushed += 1
+                    report.bytes_pushed += size
+                else:
+                    if outcome == 'mounted':
+                        report.layers_mounted += 1
+                    else:
+                        report.layers_skipped += 1
+                    report.bytes_skipped += size
+
+            if not client.blob_exists(repository, config_digest):
+                self._with_retries(self._upload, client, repository, config_digest, config)
+
+            client.put_manifest(repository, tag, dumps({
+                'schemaVersion': 2,
+                'mediaType': MANIFEST_MEDIA_TYPE,
+                'config': {'mediaType': CONFIG_MEDIA_TYPE, 'size': len(config), 'digest': config_digest},
+                'layers': [{'mediaType': LAYER_MEDIA_TYPE, 'size': size, 'digest': digest} for digest, size, _ in layers]
+            }).encode(), MANIFEST_MEDIA_TYPE)
+
+        logger.info("Pushed %s: %s." % (image_name, report))
+        return report
+
+    def _save(self, image_name, directory):
+        """Exports the image into `directory` and returns its entry of the `manifest.json` of the export."""
+        archive = path.join(directory, 'image.tar')
+        if Popen(('docker', '--config', self.docker_config_dir, 'save', '-o', archive, image_name), stdout=DEVNULL, stderr=DEVNULL).wait() != 0:
+            raise ChildProcessError("Docker save failed!")
+
+        with tarfile.open(archive) as tar:
+            tar.extractall(directory)
+
+        with open(path.join(directory, 'manifest.json')) as f:
+            return load(f)[0]
+
+    def _push_layer(self, client, repository, directory, layer_path, diff_id):
+        """Makes sure a layer is in the repository. Returns its digest, size and whether it was pushed/skipped/mounted."""
+        cached = self._get_cached_layer(diff_id)
+
+        if cached is not None and client.blob_exists(repository, cached['digest']):
+            return cached['digest'], cached['size'], 'skipped'
+
+        if cached is not None and cached['repository'] != repository:
+            mounted, _ = client.mount_blob(repository, cached['digest'], cached['repository'])
+            if mounted:
+                return cached['digest'], cached['size'], 'mounted'
+
+        compressed_path = path.join(directory, diff_id.replace(':', '-') + '.tar.gz')
+        digest, size = compress(path.join(directory, layer_path), compressed_path)
+
+        if client.blob_exists(repository, digest):  # Pushed by someone else, like another builder
+            outcome = 'skipped'
+        else:
+            self._with_retries(self._upload, client, repository, digest, compressed_path)
+            outcome = 'pushed'
+
+        self._cache_layer(diff_id, digest, size, repository)
+        return digest, size, outcome
+
+    @staticmethod
+    def _upload(client, repository, digest, content):
+        location = client.start_upload(repository)
+        if isinstance(content, bytes):
+            client.upload_blob(repository, location, digest, content)
+            return
+
+        with open(content, 'rb') as f:
+            client.upload_blob(repository, location, digest, f)
+
+    def _with_retries(self, fn, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args)
+            except RequestException as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Upload failed (%s), retrying..." % str(e))
+                sleep(2 ** attempt)
+
+    def _get_cached_layer(self, diff_id):
+        try:
+            with open(path.join(self.cache_dir, diff_id.replace(':', '-'))) as f:
+                return load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _cache_layer(self, diff_id, digest, size, repository):
+        with open(path.join(self.cache_dir, diff_id.replace(':', '-')), 'w') as f:
+            dump({'digest': digest, 'size': size, 'repository': repository}, f)
+
+
+def get_config_digest(manifest, media_type):
+    """Returns the digest of the image config of a raw manifest, or `None` if it's a list of manifests."""
+    if media_type.split(';')[0].strip() not in (MANIFEST_MEDIA_TYPE, 'application/vnd.oci.image.manifest.v1+json'):
+        return None
+    try:
+        return loads(manifest)['config']['digest']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def compress(source, destination):
+    """
+    Gzips a layer deterministically (no timestamp or name in the header) and returns its digest and size. Layers are
+    mostly binaries that don't compress much better at the higher levels, which take a lot longer.
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=COMPRESS_LEVEL, mtime=0) as dst:
+            copyfileobj(src, dst, 1024 * 1024)
+
+    digest = sha256()
+    with open(destination, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest(), path.getsize(destination)
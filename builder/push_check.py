@@ -0,0 +1,100 @@
+"""
+Checks `RegistryPusher` against a throwaway local registry (a `registry:2` container), with an image that's already on
+the Docker host:
+
+    python -m builder.push_check python:3.11-slim
+
+The image is pushed to a repository twice and then to another repository, and it's pulled back by Docker at the end.
+The first push has to upload the layers, the second one has to be skipped, the third one has to mount all the layers
+instead of uploading them, and the pulled image has to be the same as the original one.
+"""
+import logging
+from argparse import ArgumentParser
+from subprocess import PIPE, run
+from tempfile import TemporaryDirectory
+from time import sleep
+
+import requests
+
+from .push import RegistryPusher
+
+logger = logging.getLogger('runner')
+
+
+def docker(*args):
+    process = run(('docker',) + args, stdout=PIPE, stderr=PIPE, text=True)
+    if process.returncode != 0:
+        raise ChildProcessError("docker %s failed: %s" % (args[0], process.stderr.strip()))
+    return process.stdout.strip()
+
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def start_registry(port):
+    """Starts a registry on `port` of the loopback interface, which Docker talks to over HTTP, and waits for it."""
+    container = docker('run', '--detach', '--rm', '--publish', '127.0.0.1:%d:5000' % port, 'registry:2')
+    for _ in range(50):
+        try:
+            if requests.get('http://127.0.0.1:%d/v2/' % port, timeout=1).status_code == 200:
+                return container
+        except requests.RequestException:
+            pass
+        sleep(.2)
+
+    docker('stop', container)
+    raise RuntimeError("The registry did not start!")
+
+
+def check(image_name, port):
+    host = '127.0.0.1:%d' % port
+    first, second = host + '/check/first:latest', host + '/check/second:latest'
+    image_id = docker('image', 'inspect', '--format', '{{.Id}}', image_name)
+
+    docker('tag', image_name, first)
+    docker('tag', image_name, second)
+    try:
+        with TemporaryDirectory() as docker_config_dir, TemporaryDirectory() as cache_dir:
+            pusher = RegistryPusher(docker_config_dir, cache_dir, scheme='http')
+
+            report = pusher.push(first)
+            logger.info("First push: %s" % report)
+            expect(report.layers_pushed > 0 and not report.manifest_skipped, "The first push didn't upload the layers!")
+
+            report = pusher.push(first)
+            logger.info("Second push: %s" % report)
+            expect(report.manifest_skipped, "The second push wasn't skipped!")
+
+            report = pusher.push(second)
+            logger.info("Push to another repository: %s" % report)
+            expect(report.layers_pushed == 0 and report.layers_mounted > 0, "The layers weren't mounted!")
+    finally:
+        docker('rmi', first, second)
+
+    docker('pull', first)
+    try:
+        expect(docker('image', 'inspect', '--format', '{{.Id}}', first) == image_id, "The pulled image is different!")
+    finally:
+        docker('rmi', first)
+
+
+def main():
+    parser = ArgumentParser(description="Checks pushes through the registry API against a local registry.")
+    parser.add_argument('image', help="An image on the Docker host to push")
+    parser.add_argument('--port', type=int, default=5055, help="The port to run the registry on")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    container = start_registry(args.port)
+    try:
+        check(args.image, args.port)
+    finally:
+        docker('stop', container)
+
+    logger.info("Pushes through the registry API work!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+from base64 import b64decode
+from json import load
+from os import path
+from re import findall
+
+import requests
+
+MANIFEST_MEDIA_TYPES = (
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+)
+
+
+def parse_image_name(image_name):
+    """Splits a full image name like `registry:5000/group/project:tag` into its host, repository and tag."""
+    host, repository = image_name.split('/', 1)
+    repository, _, tag = repository.rpartition(':') if ':' in repository else (repository, None, 'latest')
+    return host, repository, tag
+
+
+def read_docker_credentials(config_dir, host):
+    """Returns the username and password of `host` saved by `docker login` in `config_dir`, if there are any."""
+    try:
+        with open(path.join(config_dir, 'config.json')) as f:
+            auth = load(f).get('auths', {}).get(host, {}).get('auth')
+    except FileNotFoundError:
+        return None
+
+    if not auth:
+        return None
+
+    username, _, password = b64decode(auth).decode().partition(':')
+    return username, password
+
+
+class RegistryClient:
+    """
+    A minimal client for the Docker registry HTTP API V2.
+
+    It supports both basic and token authentication, using the credentials `docker login` has saved.
+    """
+
+    def __init__(self, host, credentials=None, scheme='https'):
+        self.base_url = '%s://%s/v2' % (scheme, host)
+        self.credentials = credentials
+
+        self._session = requests.Session()
+        self._tokens = {}
+
+    def manifest_exists(self, repository, reference):
+        return self._request('HEAD', repository, 'manifests/' + reference, headers={
+            'Accept': ', '.join(MANIFEST_MEDIA_TYPES)
+        }).status_code == 200
+
+    def get_manifest(self, repository, reference):
+        """Returns the raw manifest of `reference` and its media type, or `None` if it doesn't exist."""
+        response = self._request('GET', repository, 'manifests/' + reference, headers={
+            'Accept': ', '.join(MANIFEST_MEDIA_TYPES)
+        })
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content, response.headers['Content-Type']
+
+    def put_manifest(self, repository, reference, manifest, media_type):
+        self._request('PUT', repository, 'manifests/' + reference, data=manifest, headers={
+            'Content-Type': media_type
+        }).raise_for_status()
+
+    def tag(self, repository, source, target):
+        """Adds the tag `target` to the manifest of `source` without moving any blobs. Returns whether it existed."""
+        manifest = self.get_manifest(repository, source)
+        if manifest is None:
+            return False
+
+        self.put_manifest(repository, target, *manifest)
+        return True
+
+    def blob_exists(self, repository, digest):
+        return self._request('HEAD', repository, 'blobs/' + digest).status_code == 200
+
+    def mount_blob(self, repository, digest, source):
+        """
+        Asks the registry to link the blob `digest` of the repository `source` into `repository` without uploading it.
+        Returns whether it was mounted, and if not, the location of the upload session the registry started instead.
+        """
+        response = self._request(
+            'POST', repository, 'blobs/uploads/', params={'mount': digest, 'from': source},
+            scopes=('repository:%s:pull,push' % repository, 'repository:%s:pull' % source)
+        )
+        response.raise_for_status()
+        if response.status_code == 201:
+            return True, None
+        return False, response.headers['Location']
+
+    def start_upload(self, repository):
+        response = self._request('POST', repository, 'blobs/uploads/')
+        response.raise_for_status()
+        return response.headers['Location']
+
+    def upload_blob(self, repository, location, digest, file):
+        """Uploads the whole content of `file` to the upload session at `location` in a single request."""
+        separator = '&' if '?' in location else '?'
+        self._request('PUT', repository, location + separator + 'digest=' + digest, data=file, headers={
+            'Content-Type': 'application/octet-stream'
+        }).raise_for_status()
+
+    def _request(self, method, repository, endpoint, headers=None, scopes=None, **kwargs):
+        if endpoint.startswith(('http://', 'https://')):
+            url = endpoint
+        elif endpoint.startswith('/'):  # Upload locations may be relative to the host
+            url = self.base_url[:-len('/v2')] + endpoint
+        else:
+            url = '/'.join((self.base_url, repository, endpoint))
+        headers = dict(headers or {})
+        scopes = scopes or ('repository:%s:pull,push' % repository,)
+
+        token = self._tokens.get(scopes)
+        if token is not None:
+            headers['Authorization'] = 'Bearer ' + token
+
+        response = self._session.request(method, url, headers=headers, auth=None if token else self.credentials, **kwargs)
+        if response.status_code == 401 and 'Bearer' in response.headers.get('WWW-Authenticate', ''):
+            if hasattr(kwargs.get('data'), 'seek'):
+                kwargs['data'].seek(0)
+            headers['Authorization'] = 'Bearer ' + self._authenticate(scopes, response.headers['WWW-Authenticate'])
+            response = self._session.request(method, url, headers=headers, **kwargs)
+
+        return response
+
+    def _authenticate(self, scopes, challenge):
+        params = dict(findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop('realm')
+        params['scope'] = list(scopes)
+
+        response = self._session.get(realm, params=params, auth=self.credentials)
+        response.raise_for_status()
+
+        body = response.json()
+        self._tokens[scopes] = token = body.get('token') or body['access_token']
+        return token
@@ -0,0 +1,161 @@
+import logging
+from collections import defaultdict
+from time import monotonic
+
+from sentry_sdk import capture_exception
+
+from .consumer import PoolConsumer
+from .metrics import SCHEDULER_DISPATCHED, SCHEDULER_PENDING, SCHEDULER_THROTTLED, SCHEDULER_WAIT_SECONDS
+
+logger = logging.getLogger('runner')
+
+# Errors of `classify` that mean the message itself is broken, like invalid JSON or a missing field
+UNDECODABLE_ERRORS = (ValueError, KeyError, TypeError)
+
+
+class Job:
+    __slots__ = ('channel', 'delivery_tag', 'body', 'key', 'team', 'problem', 'priority', 'received_at')
+
+    def __init__(self, channel, delivery_tag, body, key=None, team=None, problem=None, priority=False):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = body
+        self.key = key
+        self.team = team
+        self.problem = problem
+        self.priority = priority
+        self.received_at = monotonic()
+
+    @property
+    def lane(self):
+        return 'priority' if self.priority else 'normal'
+
+
+class FairShareScheduler:
+    """
+    Decides which one of the waiting jobs should be run next.
+
+    Priority jobs always go first. Otherwise, problems share the workers by weighted fair queueing: every dispatched
+    job advances the virtual time of its problem by the inverse of the problem's weight, and the problem with the
+    smallest virtual time goes next. In both cases, a team can't have more than `team_limit` jobs running at once.
+    """
+
+    def __init__(self, team_limit, problem_weights=None):
+        self.team_limit = team_limit
+        self.problem_weights = problem_weights or {}
+
+        self._pending = []
+        self._running_per_team = defaultdict(int)
+        self._virtual_times = {}
+        self._virtual_time = 0.
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, job):
+        # A problem that has been idle starts from the current virtual time, so it can't claim the time it missed
+        self._virtual_times[job.problem] = max(self._virtual_times.get(job.problem, 0.), self._virtual_time)
+        self._pending.append(job)
+
+        SCHEDULER_PENDING.labels(str(job.problem)).inc()
+
+    def pop(self, ignore_team_limit=False):
+        """Removes and returns the job that should be run next, or `None` if no job can be run now."""
+        eligible = [job for job in self._pending if ignore_team_limit or self._is_team_eligible(job)]
+        if len(eligible) < len(self._pending):
+            SCHEDULER_THROTTLED.inc(len(self._pending) - len(eligible))
+        if not eligible:
+            return None
+
+        # The pending jobs are in the order they were received, so `min` keeps jobs of a problem in FIFO order
+        job = min(eligible, key=lambda j: (not j.priority, self._virtual_times[j.problem]))
+        self._pending.remove(job)
+
+        self._running_per_team[job.team] += 1
+        self._virtual_time = self._virtual_times[job.problem]
+        self._virtual_times[job.problem] += 1. / self.problem_weights.get(job.problem, 1.)
+
+        SCHEDULER_PENDING.labels(str(job.problem)).dec()
+        SCHEDULER_DISPATCHED.labels(job.lane, str(job.problem)).inc()
+        SCHEDULER_WAIT_SECONDS.labels(job.lane).observe(monotonic() - job.received_at)
+
+        return job
+
+    def clear(self):
+        """Forgets all the pending and running jobs."""
+        for job in self._pending:
+            SCHEDULER_PENDING.labels(str(job.problem)).dec()
+        self._pending.clear()
+        self._running_per_team.clear()
+
+    def done(self, job):
+        self._running_per_team[job.team] -= 1
+        if not self._running_per_team[job.team]:
+            del self._running_per_team[job.team]
+
+    def _is_team_eligible(self, job):
+        return job.team is None or self._running_per_team[job.team] < self.team_limit
+
+
+class ScheduledPoolConsumer(PoolConsumer):
+    """
+    A `PoolConsumer` that prefetches a window of messages and lets a `FairShareScheduler` pick which one of them is
+    built whenever a worker is free.
+
+    `classify` is given the body of each message and returns its team, problem and whether it's a priority job. A
+    message it can't decode is rejected, so it's dropped (or dead-lettered) instead of being redelivered over and over.
+    A message it fails on otherwise (like when the database is unreachable) goes to the priority lane, so it's still
+    built. The scheduler's state is only touched in the consumer thread.
+    """
+
+    def __init__(self, client, queue_name, pool, handler, scheduler, classify, window, **kwargs):
+        super().__init__(client, queue_name, pool, handler, **kwargs)
+        self.scheduler = scheduler
+        self.classify = classify
+        self.window = max(window, pool.size)
+
+        self._running = {}
+
+    @property
+    def prefetch_count(self):
+        return self.window
+
+    def _reset(self):
+        super()._reset()
+        # The broker delivers the messages of the pending and the running jobs again
+        self.scheduler.clear()
+        self._running.clear()
+
+    def _submit(self, channel, delivery_tag, body, key):
+        try:
+            team, problem, priority = self.classify(body)
+        except UNDECODABLE_ERRORS as e:
+            capture_exception(e)
+            logger.error("Could not decode message, rejecting it: %s" % str(e))
+
+            self._keys.discard(key)
+            channel.basic_reject(delivery_tag, requeue=False)
+            return
+        except Exception as e:
+            capture_exception(e)
+            logger.warning("Could not classify message, giving it priority: %s" % str(e))
+            team, problem, priority = None, None, True
+
+        self.scheduler.add(Job(channel, delivery_tag, body, key, team, problem, priority))
+        self._dispatch()
+
+    def _finish(self, channel, delivery_tag):
+        super()._finish(channel, delivery_tag)
+
+        self.scheduler.done(self._running.pop(delivery_tag))
+        self._dispatch()
+
+    def _dispatch(self):
+        while len(self._running) < self.pool.size:
+            # No other message can arrive while the window is full, so leaving the workers idle would be a waste
+            job = self.scheduler.pop(ignore_team_limit=len(self.scheduler) + len(self._running) >= self.window)
+            if job is None:
+                return
+
+            self._running[job.delivery_tag] = job
+            super()._submit(job.channel, job.delivery_tag, job.body, job.key)
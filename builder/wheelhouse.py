@@ -0,0 +1,111 @@
+import logging
+from argparse import ArgumentParser
+from functools import partial
+from hashlib import sha256
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os import getgid, getuid, makedirs, path
+from re import compile
+from subprocess import Popen, PIPE, DEVNULL
+from threading import Thread
+
+logger = logging.getLogger('runner')
+
+# Requirements that pin a release of a package on the index, like `numpy==1.24.2` or `uvicorn[standard]==0.21.1`
+PINNED_REQUIREMENT_PATTERN = compile(r'[A-Za-z0-9][A-Za-z0-9._-]*(\[[A-Za-z0-9._, -]*\])?\s*==\s*[A-Za-z0-9.!+_-]+')
+
+
+def get_pinned_requirements(requirements):
+    """
+    Returns the lines of a requirements file that pin a release on the index, leaving out paths, URLs, VCS
+    requirements and options (like `-e` or `--index-url`), whose wheels can't be shared between teams.
+    """
+    pinned = []
+    for line in requirements.splitlines():
+        line = line.split(' #', 1)[0].strip()
+        if PINNED_REQUIREMENT_PATTERN.fullmatch(line):
+            pinned.append(line)
+    return pinned
+
+
+class Wheelhouse:
+    """
+    A directory of wheels shared by the Python builds of a host, with a subdirectory for each Python version.
+
+    It's served over HTTP, and builds use it as pip's `--find-links`, so requirements that were installed before are
+    copied from it instead of being downloaded (and maybe compiled) again. Each set of requirements is resolved into it
+    only once per Python version, either after the first build that installs them or ahead of time.
+
+    Wheels are only built in the official image of the Python version, and only for requirements that pin a release on
+    the index, so the code of a submission never writes to the wheelhouse that other builds install from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        makedirs(path.join(directory, '.resolved'), exist_ok=True)
+
+    @staticmethod
+    def key(requirements, python_version):
+        lines = sorted(line.strip() for line in requirements.splitlines() if line.strip() and not line.startswith('#'))
+        return sha256('\0'.join([python_version] + lines).encode()).hexdigest()
+
+    def get_path(self, python_version):
+        return path.join(self.directory, 'py' + python_version)
+
+    def has(self, requirements, python_version):
+        return path.exists(path.join(self.directory, '.resolved', self.key(requirements, python_version)))
+
+    def populate(self, requirements, python_version, docker_config_dir):
+        """Builds the wheels of the pinned requirements of `requirements` in the official image of the Python version."""
+        if self.has(requirements, python_version):
+            return
+
+        pinned = get_pinned_requirements(requirements)
+        if pinned:
+            wheels_path = self.get_path(python_version)
+            makedirs(wheels_path, exist_ok=True)
+
+            process = Popen((
+                'docker', '--config', docker_config_dir, 'run', '--rm', '-i',
+                '--user', '%d:%d' % (getuid(), getgid()), '--env', 'HOME=/tmp',
+                '-v', '%s:/wheelhouse' % path.abspath(wheels_path), 'python:%s' % python_version,
+                'pip', 'wheel', '--quiet', '--find-links', '/wheelhouse', '--wheel-dir', '/wheelhouse', '-r', '/dev/stdin'
+            ), stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+            process.communicate('\n'.join(pinned).encode())
+            if process.returncode != 0:
+                raise ChildProcessError("Building wheels for Python %s failed!" % python_version)
+
+        open(path.join(self.directory, '.resolved', self.key(requirements, python_version)), 'w').close()
+        logger.info("Added %d requirements to the wheelhouse of Python %s." % (len(pinned), python_version))
+
+    def serve(self, host, port):
+        """Serves the wheelhouse over HTTP in the background, on the address builds reach the host at."""
+        server = ThreadingHTTPServer((host, port), partial(QuietRequestHandler, directory=self.directory))
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("Serving the wheelhouse on %s:%d..." % (host, port))
+        return server
+
+
+class QuietRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = ArgumentParser(description="Builds the wheels of requirement files into a wheelhouse ahead of time.")
+    parser.add_argument('directory', help="The wheelhouse directory, the one builder.wheelhouse_dir is set to")
+    parser.add_argument('requirements', nargs='+', help="Requirement files to build the wheels of")
+    parser.add_argument('--python', action='append', required=True, help="Python versions to build the wheels for")
+    parser.add_argument('--docker-config', default='/data/docker')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    wheelhouse = Wheelhouse(args.directory)
+    for requirements_path in args.requirements:
+        with open(requirements_path) as f:
+            requirements = f.read()
+        for python_version in args.python:
+            wheelhouse.populate(requirements, python_version, args.docker_config)
+
+
+if __name__ == '__main__':
+    main()
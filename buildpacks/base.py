@@ -1,13 +1,89 @@
-from os import path, walk
+from collections import defaultdict
+from os import getcwd, path, walk
 from re import search
 
 from repo2docker.buildpacks.base import BaseImage
 
+CCACHE_BUILD_SCRIPT = path.join(path.dirname(path.abspath(__file__)), 'ccache-build.sh')
+CCACHE_BUILD = 'bash /usr/local/bin/ccache-build'
+
+# Directories of version control systems, which never contain any code of the project
+VCS_DIRECTORIES = {'.git', '.hg', '.svn'}
+
+# Directories that never contain the code that decides how to build and run the project
+SKIPPED_DIRECTORIES = VCS_DIRECTORIES | {'__pycache__', 'node_modules', 'vendor', '.venv', 'venv'}
+
+
+class FileIndex:
+    """
+    An index of the files of the current directory (the checkout being built), built with a single walk of its tree.
+
+    Paths are kept relative to the checkout (like `./src/main.py`) and in a deterministic order, so all the buildpacks
+    can look files up by extension or pattern without walking the tree again.
+    """
+
+    def __init__(self):
+        self.root = getcwd()
+        self.files = []
+        self.sizes = {}
+
+        self._by_extension = defaultdict(list)
+        self._by_pattern = {}
+
+        for directory, directories, files in walk('.'):
+            directories[:] = sorted(d for d in directories if d not in SKIPPED_DIRECTORIES)
+
+            for file in sorted(files):
+                file_path = path.join(directory, file)
+                try:
+                    self.sizes[file_path] = path.getsize(file_path)
+                except OSError:  # A broken symbolic link
+                    continue
+
+                self.files.append(file_path)
+                self._by_extension[path.splitext(file)[1]].append(file_path)
+
+    def with_extension(self, *extensions):
+        if len(extensions) == 1:
+            return list(self._by_extension.get(extensions[0], ()))
+        return [file for file in self.files if path.splitext(file)[1] in extensions]
+
+    def matching(self, pattern):
+        if pattern not in self._by_pattern:
+            self._by_pattern[pattern] = [file for file in self.files if search(pattern, file) is not None]
+        return list(self._by_pattern[pattern])
+
+
+_file_index = None
+
+
+def get_file_index():
+    """Returns the index of the current directory, which is the checkout being built."""
+    global _file_index
+
+    if _file_index is None or _file_index.root != getcwd():
+        _file_index = FileIndex()
+    return _file_index
+
 
 def filter_files(pattern):
-    return filter(lambda x: search(pattern, x) is not None, (
-        val for sublist in ((path.join(i[0], j) for j in i[2]) for i in walk('.')) for val in sublist
-    ))
+    return iter(get_file_index().matching(pattern))
+
+
+def files_with_extension(*extensions):
+    return get_file_index().with_extension(*extensions)
+
+
+def walk_files_with_extension(*extensions):
+    """
+    Returns the files with one of the extensions in the current directory, in a deterministic order. Unlike the index,
+    only version control directories are skipped, so vendored code (like in `vendor/`) is included.
+    """
+    found = []
+    for directory, directories, files in walk('.'):
+        directories[:] = sorted(d for d in directories if d not in VCS_DIRECTORIES)
+        found.extend(path.join(directory, file) for file in sorted(files) if path.splitext(file)[1] in extensions)
+    return found
 
 
 def find_first_file_by_pattern(pattern):
@@ -25,6 +101,18 @@ class CompileBuildPackMixin:
         return ["./bin/out"]
 
 
+class CCacheBuildPackMixin:
+    """Installs ccache and a wrapper that runs build commands with it, through `CCACHE_BUILD`."""
+
+    def get_packages(self):
+        return super().get_packages() | {'ccache'}
+
+    def get_build_script_files(self):
+        files = super().get_build_script_files()
+        files[CCACHE_BUILD_SCRIPT] = '/usr/local/bin/ccache-build'
+        return files
+
+
 class DetectByConfigFileMixin:
     eligible_config_filenames = set()
 
@@ -0,0 +1,19 @@
+#!/bin/bash
+# Runs a build command with ccache in front of the compilers and prints the statistics of the cache after it.
+# The cache is only used if the builder mounted a persistent one at $CCACHE_DIR, since it would only bloat the image
+# otherwise.
+
+export CCACHE_DIR="${CCACHE_DIR:-/srv/ccache}"
+export PATH="/usr/lib/ccache:$PATH"
+
+if ! mountpoint -q "$CCACHE_DIR"; then
+  export CCACHE_DISABLE=1
+  exec "$@"
+fi
+
+ccache --zero-stats > /dev/null
+"$@"
+status=$?
+echo "ccache statistics:"
+ccache --show-stats
+exit $status
@@ -9,11 +9,13 @@ class CMakeBuildPack(MakeBuildPack):
 
     def get_assemble_scripts(self):
         """
-        Simply runs `cmake .` and `make`.
+        Simply runs `cmake .` and `make`, with ccache launching the compilers.
         """
         assemble_scripts = super().get_assemble_scripts()
 
         # `cmake` command should be run before `make`.
-        assemble_scripts.insert(len(assemble_scripts) - 1, ("${NB_USER}", 'cmake .'))
+        assemble_scripts.insert(len(assemble_scripts) - 1, (
+            "${NB_USER}", 'cmake -DCMAKE_C_COMPILER_LAUNCHER=ccache -DCMAKE_CXX_COMPILER_LAUNCHER=ccache .'
+        ))
 
         return assemble_scripts
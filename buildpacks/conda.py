@@ -1,24 +1,15 @@
-from re import search, MULTILINE
-
 from repo2docker.buildpacks.conda import CondaBuildPack
 
-from .base import filter_files
+from .entrypoint import EntryPointRule, find_entry_point
+
+PYTHON_ENTRY_POINT = EntryPointRule(
+    ('.py',), (r"^if\s+__name__\s*==\s*[\"']__main__[\"']\s*:",), ('main.py', '__main__.py', 'app.py', 'run.py'),
+    fallback='single'
+)
 
 
 def find_python_main_file():
-    count = 0
-    for file in filter_files(r"\.py$"):
-        count += 1
-        with open(file) as f:
-            content = f.read()
-            if search(r"^if\s+__name__\s*==\s*[\"']__main__[\"']\s*:", content, flags=MULTILINE) is not None:
-                return file
-
-    # If there was only one Python file in the project, return it anyway
-    if count == 1:
-        return file
-
-    raise RuntimeError("Could not find main file! Aborting dockerization...")
+    return find_entry_point(PYTHON_ENTRY_POINT)
 
 
 class PythonRunCommandDetectorMixin:
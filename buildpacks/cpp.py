@@ -1,21 +1,70 @@
-from buildpacks.base import BaseSmartBuildPack, CompileBuildPackMixin
+from base64 import b64encode
 
+from buildpacks.base import (
+    CCACHE_BUILD, BaseSmartBuildPack, CCacheBuildPackMixin, CompileBuildPackMixin, walk_files_with_extension
+)
 
-class CPPBuildPack(CompileBuildPackMixin, BaseSmartBuildPack):
+NINJA_FILE = '.packman.ninja'
+
+# As many jobs as the CPU quota of the build's cgroup allows, or as many as the CPUs it can use if there isn't one
+JOBS = r"""$(awk '$1 != "max" {print int(($1 + $2 - 1) / $2); exit} {exit 1}' /sys/fs/cgroup/cpu.max 2>/dev/null || nproc)"""
+
+
+def escape_ninja_path(file):
+    return file.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def generate_ninja_file(sources):
+    """
+    Generates a Ninja build file that compiles each source file on its own, tracking the headers they include, and then
+    links them into `bin/out`.
+    """
+    lines = [
+        'ninja_required_version = 1.3',
+        '',
+        'rule cxx',
+        '  command = g++ -MMD -MF $out.d -c $in -o $out',
+        '  depfile = $out.d',
+        '  deps = gcc',
+        '  description = Compiling $in',
+        '',
+        'rule link',
+        '  command = g++ $in -o $out',
+        '  description = Linking $out',
+        '',
+    ]
+
+    objects = []
+    for source in sorted(sources):
+        source = escape_ninja_path(source[2:] if source.startswith('./') else source)
+        objects.append('obj/' + source + '.o')
+        lines.append('build %s: cxx %s' % (objects[-1], source))
+
+    lines.extend(['', 'build bin/out: link ' + ' '.join(objects), '', 'default bin/out', ''])
+    return '\n'.join(lines)
+
+
+class CPPBuildPack(CCacheBuildPackMixin, CompileBuildPackMixin, BaseSmartBuildPack):
     eligible_filename_pattern = r"\.cpp$"
 
     def get_base_image(self):
         """GCC image is based on buildpack-deps image, so it's compatible with repo2docker."""
         return "gcc:12"
 
+    def get_packages(self):
+        return super().get_packages() | {'ninja-build'}
+
     def get_assemble_scripts(self):
         """
-        Gets the list of all the .cpp files and tries to compile them.
+        Generates a Ninja build graph of all the .cpp files (vendored ones included), so they are compiled in parallel
+        (through ccache) and only then linked together.
         """
+        ninja_file = b64encode(generate_ninja_file(walk_files_with_extension('.cpp')).encode()).decode()
+
         assemble_scripts = super().get_assemble_scripts()
         assemble_scripts.extend([
-            ("${NB_USER}", 'mkdir bin'),
-            ("${NB_USER}", r'find -name "*.cpp" | tr "\n" " " | xargs g++ -o bin/out'),
+            ("${NB_USER}", 'echo %s | base64 -d > %s' % (ninja_file, NINJA_FILE)),
+            ("${NB_USER}", '%s ninja -f %s -j "%s"' % (CCACHE_BUILD, NINJA_FILE, JOBS)),
             ("${NB_USER}", 'chmod +x bin/out')
         ])
         return assemble_scripts
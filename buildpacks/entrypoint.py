@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from mmap import mmap, ACCESS_READ
+from os import path
+from re import compile, MULTILINE
+
+from .base import files_with_extension, get_file_index
+
+# The file in the root of a project that can name its entry point, relative to the root
+PIN_FILE = '.entrypoint'
+
+# Only this much of the start and of the end of each file is scanned, so huge files can't slow the detection down
+SCAN_SIZE = 256 * 1024
+SCAN_WORKERS = 8
+
+
+class EntryPointRule:
+    """
+    Describes the entry point of a language: files with one of `extensions` in which all of `patterns` are found.
+
+    Without any patterns, every file with the extensions is a candidate. Candidates are ranked by their depth in the
+    project and then by whether they have one of the `conventional_names` (in that order), and then by their path.
+    """
+
+    def __init__(self, extensions, patterns=(), conventional_names=(), fallback=None):
+        self.extensions = tuple(extensions)
+        self.patterns = tuple(compile(pattern.encode(), MULTILINE) for pattern in patterns)
+        self.conventional_names = tuple(conventional_names)
+        # What to pick when no file has the patterns: nothing, the only candidate if there's one ('single') or the
+        # best ranked candidate ('any')
+        self.fallback = fallback
+
+    def rank(self, file):
+        name = path.basename(file)
+        conventional_rank = (
+            self.conventional_names.index(name) if name in self.conventional_names else len(self.conventional_names)
+        )
+        return file.count(path.sep), conventional_rank, file
+
+
+def find_entry_point(rule):
+    """
+    Returns the path of the entry point of the project in the current directory. Raises `RuntimeError` if there isn't
+    one.
+    """
+    pinned = get_pinned_entry_point(rule)
+    if pinned is not None:
+        return pinned
+
+    candidates = sorted(files_with_extension(*rule.extensions), key=rule.rank)
+    if not rule.patterns and candidates:
+        return candidates[0]
+
+    if candidates:
+        with ThreadPoolExecutor(min(SCAN_WORKERS, len(candidates))) as executor:
+            results = executor.map(lambda file: matches_all(file, rule.patterns), candidates)
+            for file, matched in zip(candidates, results):
+                if matched:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return file
+
+    if (rule.fallback == 'single' and len(candidates) == 1) or (rule.fallback == 'any' and candidates):
+        return candidates[0]
+
+    raise RuntimeError("Could not find main file! Aborting dockerization...")
+
+
+def get_pinned_entry_point(rule):
+    """Returns the entry point named in the pin file of the project, if there is one for the language of `rule`."""
+    if not path.isfile(PIN_FILE):
+        return None
+
+    with open(PIN_FILE) as f:
+        for line in f:
+            file = line.strip()
+            if not file or file.startswith('#') or not file.endswith(rule.extensions):
+                continue
+
+            file = path.join('.', path.normpath(file))
+            if not path.isfile(file):
+                raise RuntimeError("The pinned entry point %s does not exist! Aborting dockerization..." % file)
+            return file
+
+    return None
+
+
+def matches_all(file, patterns):
+    """Returns whether all of the patterns are found at the start or at the end of the file."""
+    size = get_file_index().sizes.get(file)
+    if size is None:
+        size = path.getsize(file)
+    if size == 0:
+        return False
+
+    with open(file, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as content:
+        windows = [(0, min(size, SCAN_SIZE))]
+        if size > SCAN_SIZE:
+            windows.append((max(SCAN_SIZE, size - SCAN_SIZE), size))
+
+        return all(
+            any(pattern.search(content, start, end) is not None for start, end in windows) for pattern in patterns
+        )
+
+
+def search_header(file, pattern):
+    """Returns the first match of the pattern at the start of the file, decoded, or `None`."""
+    if path.getsize(file) == 0:
+        return None
+
+    with open(file, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as content:
+        m = compile(pattern.encode(), MULTILINE).search(content, 0, SCAN_SIZE)
+        return m.group(1).decode(errors='replace') if m is not None else None
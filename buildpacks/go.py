@@ -1,4 +1,9 @@
-from buildpacks.base import BaseSmartBuildPack, CompileBuildPackMixin, filter_files
+from os import path
+
+from buildpacks.base import BaseSmartBuildPack, CompileBuildPackMixin
+from buildpacks.entrypoint import EntryPointRule, find_entry_point
+
+GO_ENTRY_POINT = EntryPointRule(('.go',), (r'^package\s+main\b', r'^func\s+main\s*\(\s*\)'), ('main.go',))
 
 
 class GoBuildPack(CompileBuildPackMixin, BaseSmartBuildPack):
@@ -8,17 +13,27 @@ class GoBuildPack(CompileBuildPackMixin, BaseSmartBuildPack):
         """Golang image is based on buildpack-deps image, so it's compatible with repo2docker."""
         return "golang:buster"
 
+    def get_preassemble_script_files(self):
+        """
+        Copies the module files before the rest of the code, so the layer of the downloaded dependencies is cached as
+        long as they don't change.
+        """
+        files = super().get_preassemble_script_files()
+        if path.exists('go.mod'):
+            files.update({file: file for file in ('go.mod', 'go.sum') if path.exists(file)})
+        return files
+
+    def get_preassemble_scripts(self):
+        preassemble_scripts = super().get_preassemble_scripts()
+        if path.exists('go.mod'):
+            preassemble_scripts.append(("${NB_USER}", 'go mod download'))
+        return preassemble_scripts
+
     def get_assemble_scripts(self):
         """
         Gets the list of all the .go files and tries to compile them.
         """
-        main_file = None
-        for file in filter_files(self.eligible_filename_pattern):
-            with open(file) as f:
-                content = f.read()
-                if content.find('package main') != -1 and content.find('func main()') != -1:
-                    main_file = file
-                    break
+        main_file = find_entry_point(GO_ENTRY_POINT)
 
         assemble_scripts = super().get_assemble_scripts()
         assemble_scripts.extend([
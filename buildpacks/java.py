@@ -1,19 +1,31 @@
-from re import search
 from os import path
 
-from buildpacks.base import BaseSmartBuildPack, filter_files
+from buildpacks.base import BaseSmartBuildPack
+from buildpacks.entrypoint import EntryPointRule, find_entry_point, search_header
+
+JAVA_ENTRY_POINT = EntryPointRule(
+    ('.java',), (r'public\s+static\s+void\s+main\s*\(\s*String\s*\[\s*\]\s+\w+\s*\)\s*{',), ('Main.java', 'App.java')
+)
+
+
+# How long the training run that records the classes loaded at startup may take
+CDS_TRAINING_TIMEOUT = 10
 
 
 class JavaNoBuildToolBuildPack(BaseSmartBuildPack):
     eligible_filename_pattern = r"\.java$"
 
+    # Whether images start with a class data sharing archive of the classes they load, set by the builder
+    cds_enabled = False
+
     def get_base_image(self):
         """OpenJDK image is based on buildpack-deps image, so it's compatible with repo2docker."""
         return "openjdk:14-buster"
 
     def get_assemble_scripts(self):
         """
-        Gets the list of all the .java files and tries to compile them.
+        Gets the list of all the .java files and tries to compile them, and then archives the classes the main class
+        loads at startup, so the JVM maps them instead of loading them again.
         """
         assemble_scripts = super().get_assemble_scripts()
         assemble_scripts.extend([
@@ -21,28 +33,32 @@ class JavaNoBuildToolBuildPack(BaseSmartBuildPack):
             ("${NB_USER}", "javac @sources.txt -d out"),
             ("${NB_USER}", "rm -f sources.txt")
         ])
+
+        if self.cds_enabled:
+            # Class data sharing only archives classes loaded from JAR files. The training run starts the main class
+            # without any input and its loaded classes are dumped when it exits, even if it's stopped by the timeout.
+            assemble_scripts.extend([
+                ("${NB_USER}", "jar cf app.jar -C out ."),
+                ("${NB_USER}", "timeout %d java -XX:ArchiveClassesAtExit=app.jsa -cp app.jar %s "
+                               "< /dev/null > /dev/null 2>&1 || true" % (CDS_TRAINING_TIMEOUT, self.get_main_class()))
+            ])
         return assemble_scripts
 
+    def get_main_class(self):
+        """
+        Tries to find the project's main method and returns its class, with its package.
+        """
+        file = find_entry_point(JAVA_ENTRY_POINT)
+
+        # Try to find the main class's package name
+        package = search_header(file, r'^\s*package\s+([\w.]+)\s*;')
+        return (package + '.' if package else '') + path.basename(file)[:-5]
+
     def get_command(self):
         """
-        Tries to find the project's main method and it's package and returns a command with them to be run.
+        Returns the command that runs the main class, with the class data sharing archive if there is one. The JVM
+        silently starts without it if the training run couldn't create it.
         """
-        main_class = None
-        for file in filter_files(self.eligible_filename_pattern):
-            with open(file) as f:
-                content = f.read()
-                if search(r'public\s+static\s+void\s+main\s*\(\s*String\s*\[\s*\]\s+\w+\s*\)\s*{', content) is not None:
-                    # Try to find the main class's package name
-                    package = ""
-                    m = search(r'^\s*package\s+(?P<package_name>\w+)\s*;', content)
-                    if m:
-                        package = m.group('package_name') + '.'
-
-                    # Create the path of the main class
-                    main_class = package + path.basename(file)[:-5]
-                    break
-
-        if main_class is None:
-            raise RuntimeError("No file with a main method found! Aborting dockerization...")
-
-        return ["java", "-cp", "out", main_class]
+        if self.cds_enabled:
+            return ["java", "-XX:SharedArchiveFile=app.jsa", "-cp", "app.jar", self.get_main_class()]
+        return ["java", "-cp", "out", self.get_main_class()]
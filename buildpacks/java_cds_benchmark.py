@@ -0,0 +1,108 @@
+"""
+Measures how much the class data sharing archive of the Java buildpack cuts the startup time of its images:
+
+    python -m buildpacks.java_cds_benchmark --runs 10
+
+A sample project is built into an image with `builder.java_cds` turned on and into another with it turned off, and
+each image is then started `--runs` times in a new container, the way runs start it, and the times are compared.
+"""
+import logging
+from argparse import ArgumentParser
+from contextlib import chdir
+from os import path
+from statistics import median
+from subprocess import DEVNULL, run
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from repo2docker.app import Repo2Docker
+
+from .java import JavaNoBuildToolBuildPack
+
+logger = logging.getLogger('runner')
+
+# Reads its input and answers with a bit of the standard library, like a typical submission does
+SAMPLE_MAIN = """
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.util.Map;
+import java.util.regex.Pattern;
+import java.util.stream.Collectors;
+
+public class Main {
+    public static void main(String[] args) {
+        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in));
+        Map<String, Long> counts = reader.lines()
+            .flatMap(Pattern.compile("\\\\s+")::splitAsStream)
+            .collect(Collectors.groupingBy(word -> word, Collectors.counting()));
+        System.out.println(String.format("%d distinct words", counts.size()));
+    }
+}
+"""
+
+
+def build_image(project_path, image_name, cds_enabled):
+    """Builds the project with the Java buildpack and returns the command that runs the image."""
+
+    class BenchmarkBuildPack(JavaNoBuildToolBuildPack):
+        pass
+
+    BenchmarkBuildPack.cds_enabled = cds_enabled
+
+    r2d = Repo2Docker()
+    r2d.repo = project_path
+    r2d.repo_type = 'local'
+    r2d.output_image_spec = image_name
+    r2d.buildpacks = []
+    r2d.default_buildpack = BenchmarkBuildPack
+    r2d.initialize()
+    r2d.build()
+
+    with chdir(project_path):
+        return BenchmarkBuildPack().get_command()
+
+
+def time_starts(image_name, command, runs):
+    """Returns how long each of `runs` new containers of the image took to run the command to the end."""
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        process = run(('docker', 'run', '--rm', '-i', image_name) + tuple(command), input=b'a b a\n', stdout=DEVNULL)
+        times.append(perf_counter() - start)
+        if process.returncode != 0:
+            raise ChildProcessError("%s exited with code %d!" % (image_name, process.returncode))
+    return times
+
+
+def main():
+    parser = ArgumentParser(description="Compares the startup time of Java images with and without class data sharing.")
+    parser.add_argument('--runs', type=int, default=10, help="How many times each image is started")
+    parser.add_argument('--image', default='packman-java-cds-benchmark', help="The repository to tag the images in")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with TemporaryDirectory() as project_path:
+        with open(path.join(project_path, 'Main.java'), 'w') as f:
+            f.write(SAMPLE_MAIN)
+
+        results = {}
+        for cds_enabled in (False, True):
+            image_name = '%s:%s' % (args.image, 'cds' if cds_enabled else 'no-cds')
+            command = build_image(project_path, image_name, cds_enabled)
+            try:
+                times = time_starts(image_name, command, args.runs)
+            finally:
+                run(('docker', 'rmi', image_name), stdout=DEVNULL, stderr=DEVNULL)
+
+            results[cds_enabled] = median(times)
+            logger.info("%s: median %.3fs, min %.3fs, max %.3fs over %d starts" % (
+                image_name, median(times), min(times), max(times), len(times)
+            ))
+
+    logger.info("Class data sharing saves %.3fs (%.1f%%) of the median start." % (
+        results[False] - results[True], 100 * (results[False] - results[True]) / results[False]
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
-from buildpacks.base import BaseSimpleBuildPack, CompileBuildPackMixin
+from buildpacks.base import CCACHE_BUILD, BaseSimpleBuildPack, CCacheBuildPackMixin, CompileBuildPackMixin
 
 
-class MakeBuildPack(CompileBuildPackMixin, BaseSimpleBuildPack):
+class MakeBuildPack(CCacheBuildPackMixin, CompileBuildPackMixin, BaseSimpleBuildPack):
     eligible_config_filenames = {"Makefile"}
 
     def get_base_image(self):
@@ -10,10 +10,10 @@ class MakeBuildPack(CompileBuildPackMixin, BaseSimpleBuildPack):
 
     def get_assemble_scripts(self):
         """
-        Simply runs `make`.
+        Simply runs `make`, with ccache in front of the compilers.
         """
         assemble_scripts = super().get_assemble_scripts()
         assemble_scripts.extend([
-            ("${NB_USER}", 'make')
+            ("${NB_USER}", CCACHE_BUILD + ' make')
         ])
         return assemble_scripts
@@ -1,7 +1,29 @@
+from urllib.parse import urlparse
+
 from repo2docker.buildpacks.python import PythonBuildPack
 
 from .conda import PythonRunCommandDetectorMixin
 
 
 class ModifiedPythonBuildPack(PythonRunCommandDetectorMixin, PythonBuildPack):
-    pass
+    # The URL of the wheelhouse served by the builder, if there is one
+    wheelhouse_url = None
+
+    def get_preassemble_scripts(self):
+        return self._with_wheelhouse(super().get_preassemble_scripts())
+
+    def get_assemble_scripts(self):
+        return self._with_wheelhouse(super().get_assemble_scripts())
+
+    def _with_wheelhouse(self, scripts):
+        """
+        Makes pip look for wheels in the wheelhouse of the Python version before downloading them. The variables are
+        only set for the commands that install the requirements, so the image doesn't keep pointing at the builder.
+        """
+        if not self.wheelhouse_url:
+            return scripts
+
+        env = 'export PIP_FIND_LINKS="%s/py%s/" PIP_TRUSTED_HOST="%s" && ' % (
+            self.wheelhouse_url.rstrip('/'), self.python_version, urlparse(self.wheelhouse_url).hostname
+        )
+        return [(user, env + script if '/bin/pip install' in script else script) for user, script in scripts]
@@ -2,12 +2,12 @@ from re import search
 
 from repo2docker.buildpacks.r import RBuildPack
 
-from .base import filter_files
+from .base import files_with_extension
 
 
 class ModifiedRBuildPack(RBuildPack):
     def get_command(self):
-        files = list(filter(lambda f: search(r'^install\.[rR]$', f) is None, filter_files(r'\.[rR]$')))
+        files = list(filter(lambda f: search(r'^install\.[rR]$', f) is None, files_with_extension('.r', '.R')))
         if len(files) < 1:
             raise RuntimeError("No R script found to run! Aborting dockerization...")
         elif len(files) > 1:
@@ -4,7 +4,7 @@ from buildpacks.cpp import CPPBuildPack
 TEMPLATE = """
 FROM gcc:12
 
-RUN apt-get update -q && apt-get install -qqy bc time && rm -rf /var/lib/apt/lists/*
+RUN apt-get update -q && apt-get install -qqy bc time {{ packages|join(" ") }} && rm -rf /var/lib/apt/lists/*
 
 WORKDIR /root
 
@@ -21,6 +21,10 @@ RUN chmod +x {{ dst }}
 
 COPY src/ .
 
+{% for sd in assemble_script_directives -%}
+{{ sd }}
+{% endfor %}
+
 CMD {{ command }}
 """
 
@@ -29,9 +33,13 @@ class CPP12STDINBuildPack(CPPBuildPack):
     template = TEMPLATE
 
     def get_build_script_files(self):
-        return {
-            "/home/worker/buildpacks/stdin/cpp-tester.sh": "cpp-tester.sh"
-        }
+        files = super().get_build_script_files()
+        files["/home/worker/buildpacks/stdin/cpp-tester.sh"] = "cpp-tester.sh"
+        return files
+
+    def get_assemble_scripts(self):
+        """Compiles the code like `CPPBuildPack`, but as root, since there's no other user in this image."""
+        return [("root", script) for _, script in super().get_assemble_scripts()]
 
     def get_env(self):
         return [('ENTRY_FILE', './bin/out')]
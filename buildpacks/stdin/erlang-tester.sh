@@ -2,7 +2,7 @@
 
 run_test() {
   echo "test case: $1"
-  /usr/bin/time -v bash -c "echo $1 | escript \"$ENTRY_FILE\" >> \"$OUTPUT_FOLDER/$RESULT_FILE\" 2>> \"$OUTPUT_FOLDER/$ERROR_FILE\""
+  /usr/bin/time -v bash -c "echo $1 | escript \"$RUN_FILE\" >> \"$OUTPUT_FOLDER/$RESULT_FILE\" 2>> \"$OUTPUT_FOLDER/$ERROR_FILE\""
 }
 
 TEST_CASES=(
@@ -25,6 +25,12 @@ ELAPSED_TIME_FILE="time"
 MAX_MEMORY_USAGE="-1"
 MAX_ELAPSED_TIME="-1"
 
+# The escript of the main module compiled at build time, if there is one
+RUN_FILE="${ENTRY_FILE%.erl}.escript"
+if [[ ! -f "$RUN_FILE" ]]; then
+  RUN_FILE="$ENTRY_FILE"
+fi
+
 touch "$OUTPUT_FOLDER/$RESULT_FILE"
 cat /dev/null > "$OUTPUT_FOLDER/$RESULT_FILE"
 touch "$OUTPUT_FOLDER/$ERROR_FILE"
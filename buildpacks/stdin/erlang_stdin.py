@@ -1,13 +1,13 @@
 from repo2docker.buildpacks.base import BaseImage
 
-from buildpacks.base import filter_files
+from buildpacks.entrypoint import EntryPointRule, find_entry_point
 
 
-def find_erlang_main_file():
-    for file in filter_files(r"\.erl$"):
-        return file
+ERLANG_ENTRY_POINT = EntryPointRule(('.erl',), (r'^main\s*\(',), ('main.erl',), fallback='any')
+
 
-    raise RuntimeError("Could not find main file! Aborting dockerization...")
+def find_erlang_main_file():
+    return find_entry_point(ERLANG_ENTRY_POINT)
 
 
 TEMPLATE = """
@@ -30,6 +30,10 @@ RUN chmod +x {{ dst }}
 
 COPY src/ .
 
+{% for sd in assemble_script_directives -%}
+{{ sd }}
+{% endfor %}
+
 CMD {{ command }}
 """
 
@@ -42,6 +46,24 @@ class Erlang25STDINBuildPack(BaseImage):
             "/home/worker/buildpacks/stdin/erlang-tester.sh": "erlang-tester.sh"
         }
 
+    def get_assemble_scripts(self):
+        """
+        Compiles the main module ahead of time into an escript of its BEAM code, which the tester runs instead of
+        interpreting the source on every run. The tester falls back to the source if the module can't be compiled, like
+        escripts without a `-module` attribute.
+        """
+        return [
+            ("root", 'mkdir -p /tmp/beam && erlc -o /tmp/beam "$ENTRY_FILE" && erl -noshell -eval \'try '
+                     'F = os:getenv("ENTRY_FILE"), M = filename:basename(F, ".erl"), '
+                     '{ok, Bin} = file:read_file("/tmp/beam/" ++ M ++ ".beam"), '
+                     '{module, Module} = code:load_binary(list_to_atom(M), F, Bin), '
+                     'true = erlang:function_exported(Module, main, 1), '
+                     'ok = escript:create(filename:rootname(F) ++ ".escript", '
+                     '[shebang, {emu_args, "-escript main " ++ M}, {beam, Bin}]), halt() '
+                     'catch _:_ -> halt(1) end.\' || true'),
+            ("root", 'rm -rf /tmp/beam')
+        ]
+
     def get_env(self):
         return [('ENTRY_FILE', find_erlang_main_file())]
 
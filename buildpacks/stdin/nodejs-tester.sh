@@ -2,7 +2,7 @@
 
 run_test() {
   echo "test case: $1"
-  /usr/bin/time -v bash -c "echo $1 | node \"$ENTRY_FILE\" >> \"$OUTPUT_FOLDER/$RESULT_FILE\" 2>> \"$OUTPUT_FOLDER/$ERROR_FILE\""
+  /usr/bin/time -v bash -c "echo $1 | node $NODE_FLAGS \"$ENTRY_FILE\" >> \"$OUTPUT_FOLDER/$RESULT_FILE\" 2>> \"$OUTPUT_FOLDER/$ERROR_FILE\""
 }
 
 TEST_CASES=(
@@ -25,6 +25,12 @@ ELAPSED_TIME_FILE="time"
 MAX_MEMORY_USAGE="-1"
 MAX_ELAPSED_TIME="-1"
 
+# Load the code compiled at build time, if v8-compile-cache was installed
+NODE_FLAGS=""
+if [[ -d /opt/node-cache/node_modules/v8-compile-cache ]]; then
+  NODE_FLAGS="-r /opt/node-cache/node_modules/v8-compile-cache"
+fi
+
 touch "$OUTPUT_FOLDER/$RESULT_FILE"
 cat /dev/null > "$OUTPUT_FOLDER/$RESULT_FILE"
 touch "$OUTPUT_FOLDER/$ERROR_FILE"
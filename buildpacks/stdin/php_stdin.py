@@ -1,13 +1,17 @@
 from repo2docker.buildpacks.base import BaseImage
 
-from buildpacks.base import filter_files
+from buildpacks.entrypoint import EntryPointRule, find_entry_point
+
+
+PHP_ENTRY_POINT = EntryPointRule(('.php',), (), ('index.php', 'main.php'))
 
 
 def find_php_main_file():
-    for file in filter_files(r"\.php"):
-        return file
+    return find_entry_point(PHP_ENTRY_POINT)
 
-    raise RuntimeError("Could not find main file! Aborting dockerization...")
+
+# OPcache settings of the CLI, for printf
+OPCACHE_SETTINGS = r"opcache.enable_cli=1\nopcache.file_cache=/root/.opcache\nopcache.file_cache_only=1\n"
 
 
 TEMPLATE = """
@@ -30,6 +34,10 @@ RUN chmod +x {{ dst }}
 
 COPY src/ .
 
+{% for sd in assemble_script_directives -%}
+{{ sd }}
+{% endfor %}
+
 CMD {{ command }}
 """
 
@@ -42,6 +50,18 @@ class PHP8STDINBuildPack(BaseImage):
             "/home/worker/buildpacks/stdin/php-tester.sh": "php-tester.sh"
         }
 
+    def get_assemble_scripts(self):
+        """
+        Enables OPcache for the CLI with a file cache only, and compiles all the scripts into it ahead of time, so PHP
+        loads their opcodes instead of compiling them on every run. Scripts that aren't in the cache are just compiled.
+        """
+        return [
+            ("root", 'docker-php-ext-enable opcache && mkdir -p /root/.opcache '
+                     '&& printf "%s" > "$PHP_INI_DIR/conf.d/warm-start.ini"' % OPCACHE_SETTINGS),
+            ("root", "php -r 'foreach (new RecursiveIteratorIterator(new RecursiveDirectoryIterator(\".\")) as $f) "
+                     "if (substr($f, -4) === \".php\") @opcache_compile_file($f);' || true")
+        ]
+
     def get_env(self):
         return [('ENTRY_FILE', find_php_main_file())]
 
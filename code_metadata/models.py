@@ -1,15 +1,90 @@
+from datetime import timedelta
+
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
+GRAPHQL_PAGE_SIZE = 100  # The maximum page size of the GitLab GraphQL API
+
+PROJECT_PATHS_QUERY = """
+query($ids: [ID!], $first: Int) {
+  projects(ids: $ids, first: $first) {
+    nodes {
+      id
+      fullPath
+    }
+  }
+}
+"""
+
+
+def fetch_git_repo_paths(project_ids):
+    """Returns the paths of the given GitLab projects, resolving up to a hundred of them in each request."""
+    project_ids = list(project_ids)
+    paths = {}
+
+    for i in range(0, len(project_ids), GRAPHQL_PAGE_SIZE):
+        ids = ['gid://gitlab/Project/%d' % project_id for project_id in project_ids[i:i + GRAPHQL_PAGE_SIZE]]
+        response = settings.GITLAB_CLIENT.http_post(
+            settings.GITLAB_URL + '/api/graphql',
+            post_data={'query': PROJECT_PATHS_QUERY, 'variables': {'ids': ids, 'first': len(ids)}}
+        )
+
+        for node in response['data']['projects']['nodes']:
+            paths[int(node['id'].rpartition('/')[2])] = node['fullPath']
+
+    return paths
+
 
 class Code(models.Model):
     project_id = models.PositiveIntegerField()
 
+    # A cache of the path of the project in GitLab
+    git_repo_path = models.CharField(max_length=255, null=True, blank=True)
+    git_repo_path_updated_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def prefetch_git_repo_paths(codes):
+        """Fills the path cache of all the given codes at once, so later lookups don't call GitLab one by one."""
+        stale_codes = [code for code in codes if code is not None and not code.has_fresh_git_repo_path()]
+        if not stale_codes:
+            return
+
+        paths = fetch_git_repo_paths({code.project_id for code in stale_codes})
+        now = timezone.now()
+
+        updated_codes = []
+        for code in stale_codes:
+            if code.project_id not in paths:  # Let `get_git_repo_path` fail on it the usual way
+                continue
+
+            code.git_repo_path, code.git_repo_path_updated_at = paths[code.project_id], now
+            # Codes may be instances of subclasses, whose own fields must not be touched
+            updated_codes.append(Code(
+                pk=code.pk, project_id=code.project_id, git_repo_path=code.git_repo_path, git_repo_path_updated_at=now
+            ))
+
+        Code.objects.bulk_update(updated_codes, ['git_repo_path', 'git_repo_path_updated_at'])
+
+    def has_fresh_git_repo_path(self):
+        return self.git_repo_path is not None and self.git_repo_path_updated_at is not None and \
+            timezone.now() - self.git_repo_path_updated_at < timedelta(seconds=settings.GITLAB_PATH_CACHE_TTL)
+
     def get_git_repo_path(self):
-        return settings.GITLAB_CLIENT.projects.get(self.project_id).path_with_namespace
+        if not self.has_fresh_git_repo_path():
+            self.git_repo_path = self.get_gitlab_project().path_with_namespace
+            self.git_repo_path_updated_at = timezone.now()
+            Code.objects.filter(pk=self.pk).update(
+                git_repo_path=self.git_repo_path, git_repo_path_updated_at=self.git_repo_path_updated_at
+            )
+        return self.git_repo_path
+
+    def invalidate_git_repo_path(self):
+        self.git_repo_path = self.git_repo_path_updated_at = None
+        Code.objects.filter(pk=self.pk).update(git_repo_path=None, git_repo_path_updated_at=None)
 
     def get_git_repo_url(self):
         return '/'.join((settings.GIT_URL, self.get_git_repo_path())) + '.git'
@@ -22,6 +97,7 @@ class Code(models.Model):
 
     def change_project_name(self, name):
         settings.GITLAB_CLIENT.projects.update(self.project_id, {'name': name})
+        self.invalidate_git_repo_path()
 
     def add_member(self, user):
         self.member_set.create(user=user)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from outbox.relay import ChannelPool, OutboxRelay
+
+
+class Command(BaseCommand):
+    help = "Publishes the messages of the outbox to the queue broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.OUTBOX_RELAY_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help="Publish a single batch and exit.")
+
+    def handle(self, *args, workers, batch_size, once, **options):
+        relay = OutboxRelay(
+            ChannelPool(settings.QUEUE_SERVER_API_URL, workers), batch_size, settings.OUTBOX_POLL_INTERVAL,
+            settings.OUTBOX_MAX_ATTEMPTS
+        )
+
+        if once:
+            self.stdout.write("Relayed %d messages." % relay.relay_batch())
+            return
+
+        relay.start(workers - 1)
+        relay.run()
@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class OutboxMessage(models.Model):
+    """
+    A message waiting to be published to the queue broker.
+
+    Messages are written in the same transaction as the changes they announce, so they're published if and only if
+    those changes are committed. `OutboxRelay` publishes and then deletes them.
+    """
+    queue = models.CharField(max_length=255)
+    body = models.TextField()
+
+    attempts = models.PositiveIntegerField(default=0)
+
+    date_created = models.DateTimeField(auto_now_add=True)
+
+
+def publish(body, queue):
+    """Publishes `body` to `queue` after the current transaction (if there's any) is committed."""
+    return OutboxMessage.objects.create(queue=queue, body=body)
+
+
+def publish_many(messages):
+    """Same as `publish`, for a list of (body, queue) pairs in one query."""
+    return OutboxMessage.objects.bulk_create([OutboxMessage(queue=queue, body=body) for body, queue in messages])
@@ -0,0 +1,180 @@
+import logging
+from contextlib import contextmanager
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+
+from django.db import transaction
+from django.db.models import F
+from pika import BasicProperties, BlockingConnection, URLParameters
+from pika.exceptions import AMQPError, NackError, UnroutableError
+from sentry_sdk import capture_exception, capture_message
+
+from .models import OutboxMessage
+
+logger = logging.getLogger('runner')
+
+PERSISTENT = BasicProperties(delivery_mode=2)
+
+# Idle connections don't answer the heartbeats of the broker, so one that has been idle longer than this (in seconds) is
+# checked before it's used again
+MAX_IDLE_TIME = 30
+
+
+class ChannelPool:
+    """
+    Keeps up to `size` open broker channels in publisher confirm mode, each on its own connection, so publishing
+    doesn't pay for connecting to the broker every time. A channel that has been idle for a while is reopened if the
+    broker has dropped its connection in the meantime.
+
+    The queues declared on each channel are remembered, so each one is only declared once per channel.
+    """
+
+    def __init__(self, url, size):
+        self.url = url
+        self._idle = Queue(size)
+        self._declared = {}  # id() of each open channel: names of the queues declared on it
+
+    @contextmanager
+    def channel(self):
+        try:
+            channel, idle_since = self._idle.get_nowait()
+        except Empty:
+            channel = None
+        else:
+            if monotonic() - idle_since > MAX_IDLE_TIME and not self._is_alive(channel):
+                self._close(channel)
+                channel = None
+        if channel is None or channel.is_closed or channel.connection.is_closed:
+            if channel is not None:
+                self._close(channel)
+            channel = self._open()
+
+        try:
+            yield channel
+        except AMQPError:
+            # The channel may be in any state now, so don't give it to anybody else
+            self._close(channel)
+            raise
+
+        try:
+            self._idle.put_nowait((channel, monotonic()))
+        except Full:
+            self._close(channel)
+
+    def declare_queue(self, channel, queue_name):
+        """Declares a durable queue on a channel of the pool, unless it has already been declared on the channel."""
+        declared = self._declared[id(channel)]
+        if queue_name not in declared:
+            channel.queue_declare(queue_name, durable=True)
+            declared.add(queue_name)
+
+    def _open(self):
+        channel = BlockingConnection(URLParameters(self.url)).channel()
+        channel.confirm_delivery()
+        self._declared[id(channel)] = set()
+        return channel
+
+    @staticmethod
+    def _is_alive(channel):
+        try:
+            # Sends and takes the heartbeats that were missed, which fails if the broker has closed the connection
+            channel.connection.process_data_events(time_limit=0)
+        except AMQPError:
+            return False
+        return channel.is_open
+
+    def _close(self, channel):
+        self._declared.pop(id(channel), None)
+        try:
+            channel.connection.close()
+        except AMQPError:
+            pass
+
+
+class OutboxRelay:
+    """
+    Publishes the messages of the outbox to the broker in batches and deletes them once the broker has confirmed them.
+
+    Each batch is locked (skipping the rows other relays have locked), so any number of relays can run at the same
+    time. A batch that fails halfway is published again from the start, so consumers may receive a message twice.
+
+    A message that the broker doesn't confirm in `max_attempts` tries is left in the outbox as a dead letter, which is
+    reported and not tried again unless its `attempts` are reset.
+    """
+
+    def __init__(self, pool, batch_size, poll_interval, max_attempts):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+    def relay_batch(self):
+        """Publishes one batch of messages and returns the number of messages published."""
+        started_at = perf_counter()
+
+        message = None
+        try:
+            with transaction.atomic():
+                messages = list(OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                    attempts__lt=self.max_attempts
+                ).order_by('id')[:self.batch_size])
+                if not messages:
+                    return 0
+
+                published, failed = [], []
+                with self.pool.channel() as channel:
+                    for message in messages:
+                        # Messages to a queue that nobody has declared yet would be returned as unroutable
+                        self.pool.declare_queue(channel, message.queue)
+                        try:
+                            channel.basic_publish(
+                                '', message.queue, message.body.encode(), properties=PERSISTENT, mandatory=True
+                            )
+                        except (UnroutableError, NackError):
+                            failed.append(message.id)
+                        else:
+                            published.append(message.id)
+
+                OutboxMessage.objects.filter(id__in=published).delete()
+                if failed:
+                    logger.warning("Broker refused %d outbox messages, they'll be retried..." % len(failed))
+                    self._count_attempt(failed)
+        except AMQPError:
+            # The message the connection failed on may be the reason, so it mustn't be tried forever either
+            if message is not None:
+                self._count_attempt([message.id])
+            raise
+
+        elapsed = perf_counter() - started_at
+        logger.info("Relayed %d messages in %.3f seconds (%.1f messages/s)." % (
+            len(published), elapsed, len(published) / elapsed
+        ))
+        return len(published)
+
+    def _count_attempt(self, ids):
+        OutboxMessage.objects.filter(id__in=ids).update(attempts=F('attempts') + 1)
+
+        dead = OutboxMessage.objects.filter(id__in=ids, attempts__gte=self.max_attempts).values_list('id', 'queue')
+        for message_id, queue in dead:
+            logger.error("Gave up on outbox message %d to queue %s after %d attempts!" % (
+                message_id, queue, self.max_attempts
+            ))
+            capture_message("Gave up on outbox message %d to queue %s!" % (message_id, queue))
+
+    def run(self):
+        while True:
+            try:
+                relayed = self.relay_batch()
+            except Exception:
+                capture_exception()
+                logger.exception("Relaying outbox messages failed!")
+                relayed = 0
+
+            if relayed < self.batch_size:
+                sleep(self.poll_interval)
+
+    def start(self, workers=1):
+        """Runs `workers` relay threads in the background."""
+        for i in range(workers):
+            Thread(target=self.run, name='outbox-relay-%d' % i, daemon=True).start()
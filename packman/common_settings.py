@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'dataset',
     'problem',
     'competition',
+    'outbox',
 ]
 
 AUTH_USER_MODEL = 'account.User'
@@ -42,3 +43,45 @@ v.watch_config()
 
 v.automatic_env()
 v.set_env_prefix('roboepics')
+
+v.set_default('gitlab.path_cache_ttl', 24 * 60 * 60)
+
+v.set_default('hub.manifest_skeleton_ttl', 5 * 60)
+
+v.set_default('builder.runtime', 'blocking')
+v.set_default('builder.engine', 'repo2docker')
+v.set_default('builder.buildkit_cache_tag', '')
+v.set_default('builder.workers', 0)
+v.set_default('builder.push_workers', 0)
+v.set_default('builder.node_name', environ.get('NODE_NAME', ''))  # Like the Kubernetes downward API's spec.nodeName
+v.set_default('builder.cache_enabled', True)
+v.set_default('builder.mirror_max_size', 20 * 1024)  # In MiB
+v.set_default('builder.wheelhouse_host', '172.17.0.1')
+v.set_default('builder.wheelhouse_port', 8700)
+v.set_default('builder.java_cds', False)  # Runs the main class of Java submissions at build time
+v.set_default('builder.wheelhouse_url', 'http://172.17.0.1:8700')
+v.set_default('builder.metrics_port', 0)
+v.set_default('builder.scheduling', False)
+v.set_default('builder.team_concurrency', 1)
+v.set_default('builder.scheduler_window', 50)
+v.set_default('builder.problem_weights', {})
+
+v.set_default('queue.submission_pusher_queue_name', 'submission-pusher')
+
+v.set_default('registry.docker_config_dir', '/data/docker')
+v.set_default('registry.scheme', 'https')
+v.set_default('registry.push_backend', 'docker')
+v.set_default('registry.push_layer_workers', 4)
+v.set_default('registry.push_retries', 3)
+v.set_default('registry.layer_cache_dir', '/data/layers')
+
+v.set_default('outbox.batch_size', 100)
+v.set_default('outbox.poll_interval', 1.)  # In seconds
+v.set_default('outbox.relay_workers', 1)
+v.set_default('outbox.max_attempts', 10)
+v.set_default('outbox.embedded_relay', True)
+
+v.set_default('tournament.batch_size', 10)
+v.set_default('tournament.max_active_runs', 20)
+v.set_default('tournament.poll_interval', 30)  # In seconds
+v.set_default('tournament.schedule_timeout', 6 * 60 * 60)  # In seconds
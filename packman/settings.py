@@ -1,4 +1,5 @@
 import os
+import socket
 
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
@@ -29,8 +30,20 @@ DATABASES = {
     }
 }
 
+# Cache, which has to be shared by all the processes (like the Redis of `cache.redis_url`), so none of them keeps
+# using what another one has invalidated. Nothing is cached without it.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': v.get('cache.redis_url'),
+    } if v.get('cache.redis_url') else {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+
 # Hub
 HUB_NAMESPACE = v.get('hub.namespace')
+ROOM_MANIFEST_SKELETON_TTL = v.get_int('hub.manifest_skeleton_ttl')  # In seconds
 
 # Gitlab
 GITLAB_ENABLED = v.get('gitlab.enabled')
@@ -38,6 +51,7 @@ GITLAB_ID = v.get('gitlab.id')
 GITLAB_CONFIG_PATH = v.get('gitlab.config_path')
 GITLAB_CLIENT = Gitlab.from_config(gitlab_id=GITLAB_ID, config_files=[GITLAB_CONFIG_PATH])
 GITLAB_URL = GITLAB_CLIENT._base_url
+GITLAB_PATH_CACHE_TTL = v.get_int('gitlab.path_cache_ttl')  # In seconds
 
 GIT_HOST = v.get('git.host')
 GIT_ADMIN_NAME = v.get('git.admin_name')
@@ -52,8 +66,16 @@ QUEUE_SERVER_USERNAME = v.get('queue.username')
 QUEUE_SERVER_PASSWORD = v.get('queue.password')
 QUEUE_SERVER_API_URL = f"amqp://{'%s:%s@' % (QUEUE_SERVER_USERNAME, QUEUE_SERVER_PASSWORD) if QUEUE_SERVER_USERNAME else ''}{QUEUE_SERVER_HOST}"
 SUBMISSION_BUILDER_QUEUE_NAME = v.get('queue.submission_builder_queue_name')
+SUBMISSION_PUSHER_QUEUE_NAME = v.get('queue.submission_pusher_queue_name')
 ROOM_QUEUE_NAME_PREFIX = v.get('queue.room_queue_name_prefix')
 
+# Outbox
+OUTBOX_BATCH_SIZE = v.get_int('outbox.batch_size')
+OUTBOX_POLL_INTERVAL = v.get_float('outbox.poll_interval')
+OUTBOX_RELAY_WORKERS = v.get_int('outbox.relay_workers')
+OUTBOX_MAX_ATTEMPTS = v.get_int('outbox.max_attempts')  # Messages the broker keeps refusing are left as dead letters
+OUTBOX_EMBEDDED_RELAY = v.get_bool('outbox.embedded_relay')  # Whether the builder relays the outbox in a thread too
+
 # S3
 S3_ACCESS_KEY_ID = v.get('s3.access_key_id')
 S3_SECRET_ACCESS_KEY = v.get('s3.secret_access_key')
@@ -63,6 +85,39 @@ S3_RESULT_BUCKET_NAME = v.get('s3.result_bucket_name')
 # Docker Registry
 DOCKER_REGISTRY_HOST = v.get('registry.host')
 RESULT_ONLY_IMAGE_PATH = v.get('registry.result_only_image_path')
+DOCKER_CONFIG_DIR = v.get('registry.docker_config_dir')
+DOCKER_REGISTRY_SCHEME = v.get('registry.scheme')
+REGISTRY_PUSH_BACKEND = v.get('registry.push_backend')  # Either 'docker' or 'api', which falls back to 'docker'
+REGISTRY_PUSH_LAYER_WORKERS = v.get_int('registry.push_layer_workers')
+REGISTRY_PUSH_RETRIES = v.get_int('registry.push_retries')
+REGISTRY_LAYER_CACHE_DIR = v.get('registry.layer_cache_dir')
+
+# Builder
+BUILDER_RUNTIME = v.get('builder.runtime')  # Either 'blocking' or 'asyncio'
+BUILDER_ENGINE = v.get('builder.engine')  # Either 'repo2docker' or 'buildkit', which falls back to repo2docker if BuildKit fails
+BUILDER_BUILDKIT_CACHE_TAG = v.get('builder.buildkit_cache_tag')  # BuildKit cache isn't exported to the registry if empty, needs a docker-container builder
+BUILDER_WORKERS = v.get_int('builder.workers')  # 0 means building inline in the consumer
+BUILDER_PUSH_WORKERS = v.get_int('builder.push_workers')  # 0 means pushing right after the build by the same worker
+BUILDER_NODE_NAME = v.get('builder.node_name') or socket.gethostname()  # Names the push queue of the Docker host
+BUILDER_CACHE_ENABLED = v.get_bool('builder.cache_enabled')
+BUILDER_MIRROR_DIR = v.get('builder.mirror_dir')  # Repositories are cloned from scratch for each build if not set
+BUILDER_MIRROR_MAX_SIZE = v.get_int('builder.mirror_max_size') * 1024 * 1024
+BUILDER_WHEELHOUSE_DIR = v.get('builder.wheelhouse_dir')  # Python builds don't share wheels if not set
+BUILDER_WHEELHOUSE_HOST = v.get('builder.wheelhouse_host')  # The host's docker0 address by default, so only builds reach it
+BUILDER_WHEELHOUSE_PORT = v.get_int('builder.wheelhouse_port')
+BUILDER_WHEELHOUSE_URL = v.get('builder.wheelhouse_url')  # Where builds reach the wheelhouse, the host's docker0 by default
+BUILDER_JAVA_CDS = v.get_bool('builder.java_cds')  # Java images start with a class data sharing archive made at build time
+BUILDER_METRICS_PORT = v.get_int('builder.metrics_port')  # The Prometheus endpoint is disabled if set to 0
+BUILDER_SCHEDULING = v.get_bool('builder.scheduling')  # Fair-share scheduling of builds across teams and problems
+BUILDER_TEAM_CONCURRENCY = v.get_int('builder.team_concurrency')
+BUILDER_SCHEDULER_WINDOW = v.get_int('builder.scheduler_window')
+BUILDER_PROBLEM_WEIGHTS = {int(k): float(w) for k, w in v.get('builder.problem_weights').items()}  # Problem id: weight
+
+# Tournament
+TOURNAMENT_BATCH_SIZE = v.get_int('tournament.batch_size')
+TOURNAMENT_MAX_ACTIVE_RUNS = v.get_int('tournament.max_active_runs')
+TOURNAMENT_POLL_INTERVAL = v.get_int('tournament.poll_interval')
+TOURNAMENT_SCHEDULE_TIMEOUT = v.get_int('tournament.schedule_timeout')
 
 # Logging
 LOGGING = {
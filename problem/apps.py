@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ProblemConfig(AppConfig):
+    name = 'problem'
+
+    def ready(self):
+        from . import signals  # Connects the receivers of the models
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from account.models import Team, User
+from code_metadata.models import Code
+from problem.enums import EvaluationMode, ProblemCodeKind
+from problem.gimulator_models import GimulatorRole, Resource
+from problem.manifests import RoomManifestBuilder
+from problem.models import GatheredSubmission, Problem, ProblemCode, ProblemEnter, Run, Submission
+
+
+class Command(BaseCommand):
+    help = (
+        "Counts the queries of building the Room manifest of a run with a single player and of one with many players, "
+        "on sample data that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=8)
+
+    def handle(self, *args, players, **options):
+        with transaction.atomic():
+            problem, runs = self.create_sample_data(players)
+
+            # The skeleton is shared by all the runs of the problem, so it's cached (if there's a cache) before counting
+            RoomManifestBuilder.get_skeleton(problem.id)
+
+            counts = {}
+            for run in runs:
+                run = Run.objects.get(id=run.id)
+                with CaptureQueriesContext(connection) as queries:
+                    RoomManifestBuilder(run).build()
+                counts[run.gatheredsubmission_set.count()] = len(queries)
+
+                if options['verbosity'] > 1:
+                    for query in queries.captured_queries:
+                        self.stdout.write('    ' + query['sql'])
+
+            transaction.set_rollback(True)
+
+        for count, queries in counts.items():
+            self.stdout.write("%d player(s): %d queries" % (count, queries))
+        if len(set(counts.values())) > 1:
+            raise CommandError("The number of queries depends on the number of players!")
+
+    @staticmethod
+    def create_sample_data(players):
+        """Creates a Room problem with a run of a single player and a run of `players` players."""
+        suffix = get_random_string(8).lower()
+        now = timezone.now()
+
+        owner = User.objects.create(
+            fusion_user_id='benchmark-' + suffix, username='benchmark-' + suffix,
+            email='benchmark-%s@example.com' % suffix, full_name='Benchmark'
+        )
+
+        director_role = GimulatorRole.objects.create(
+            name='director', resource_limit=Resource.objects.create(), resource_request=Resource.objects.create()
+        )
+        player_role = GimulatorRole.objects.create(name='player', resource_limit=Resource.objects.create())
+        problem = Problem.objects.create(
+            owner=owner, title='Benchmark', short_description='Benchmark', code_execution=True,
+            evaluation_mode=EvaluationMode.OFF, director_role=director_role
+        )
+        ProblemCode.objects.create(
+            problem=problem, kind=ProblemCodeKind.EVALUATOR, project_id=1, git_repo_path='benchmark/director',
+            git_repo_path_updated_at=now
+        )
+
+        submissions = []
+        for i in range(players):
+            enter = ProblemEnter.objects.create(
+                team=Team.objects.create(creator=owner, name='benchmark-%d' % i), problem=problem,
+                # Paths are fresh, so GitLab isn't called
+                code=Code.objects.create(
+                    project_id=i + 2, git_repo_path='benchmark/player-%d' % i, git_repo_path_updated_at=now
+                )
+            )
+            submissions.append(Submission.objects.create(submitter=owner, problem_enter=enter))
+
+        runs = []
+        for count in sorted({1, players}):
+            run = Run.objects.create(owner=owner, problem=problem)
+            GatheredSubmission.objects.bulk_create([
+                GatheredSubmission(submission=submission, run=run, role=player_role) for submission in submissions[:count]
+            ])
+            runs.append(run)
+
+        return problem, runs
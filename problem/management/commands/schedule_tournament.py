@@ -0,0 +1,46 @@
+from json import load
+
+from django.core.management.base import BaseCommand, CommandError
+
+from problem.models import Problem
+from problem.tournament import RATING, ROUND_ROBIN, SWISS, TournamentScheduler
+
+
+class Command(BaseCommand):
+    help = "Makes matchups between the latest ready submissions of the teams of a problem and starts their runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('problem_id', type=int)
+        parser.add_argument('--mode', choices=(ROUND_ROBIN, SWISS, RATING), default=ROUND_ROBIN)
+        parser.add_argument('--budget', type=int, help="The most matchups to make.")
+        parser.add_argument(
+            '--standings', help=(
+                'A JSON file with the "scores" and "ratings" of the submissions (keyed by submission ID) and the groups '
+                'of submission IDs that have "played" each other, for the Swiss and rating modes.'
+            )
+        )
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--max-active-runs', type=int)
+        parser.add_argument('--timeout', type=int, help="Seconds to wait for runs to finish before giving up.")
+
+    def handle(self, *args, problem_id, mode, budget, standings, seed, batch_size, max_active_runs, timeout, **options):
+        try:
+            problem = Problem.objects.select_related('owner').get(id=problem_id)
+        except Problem.DoesNotExist:
+            raise CommandError("No problem with ID %d exists!" % problem_id)
+
+        state = {}
+        if standings is not None:
+            with open(standings) as f:
+                state = load(f)
+
+        scheduler = TournamentScheduler(
+            problem, mode, budget,
+            scores={int(k): score for k, score in state.get('scores', {}).items()},
+            ratings={int(k): tuple(rating) for k, rating in state.get('ratings', {}).items()},
+            played=state.get('played', ()), seed=seed
+        )
+        runs = scheduler.schedule(batch_size, max_active_runs, timeout=timeout)
+
+        self.stdout.write("Created %d runs." % len(runs))
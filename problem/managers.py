@@ -1,9 +1,14 @@
+from json import dumps as json_dump
+
 from django.conf import settings
 from django.apps import apps
+from django.db import transaction
 
 from .enums import *
+from .manifests import RoomManifestBuilder
 
 from code_metadata.models import Code
+from outbox.models import publish_many
 
 
 def initialize_problem_group(problem):
@@ -45,3 +50,30 @@ class ProblemEnterManager(models.Manager):
             ) if problem.repository_mode != RepositoryMode.OFF else None,
             problem=problem, team=team
         )
+
+
+class RunManager(models.Manager):
+    def create_bulk(self, problem, owner, matchups):
+        """
+        Creates and starts a run for each one of the matchups, which are lists of (submission, role) pairs of a problem.
+
+        All the rows and the manifests of the runs are created in a single transaction with a constant number of
+        queries, and the manifests are published together by the outbox relay once it's committed. Returns the runs.
+        """
+        run_model = self.model
+        gathered_submission_model = apps.get_model('problem', 'GatheredSubmission')
+        queue_name = '%s-%d' % (settings.ROOM_QUEUE_NAME_PREFIX, problem.id)
+
+        with transaction.atomic():
+            runs = self.bulk_create([
+                run_model(owner=owner, problem=problem, status=run_model.RunStatus.POD_BUILD_JOB_ENQUEUED)
+                for _ in matchups
+            ])
+            gathered_submission_model.objects.bulk_create([
+                gathered_submission_model(run=run, submission=submission, role=role)
+                for run, matchup in zip(runs, matchups) for submission, role in matchup
+            ])
+
+            publish_many([(json_dump(manifest), queue_name) for manifest in RoomManifestBuilder.build_many(runs)])
+
+        return runs
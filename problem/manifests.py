@@ -0,0 +1,203 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .enums import ProblemCodeKind
+
+from code_metadata.models import Code
+
+
+def render_resources(role):
+    if role is None:
+        return {}
+
+    return {
+        'limits': {
+            'cpu': str(role.resource_limit.cpu),
+            'memory': str(role.resource_limit.memory) + 'Mi',
+            'ephemeral-storage': str(role.resource_limit.ephemeral) + 'Mi'
+        } if role.resource_limit else {},
+        'requests': {
+            'cpu': str(role.resource_request.cpu),
+            'memory': str(role.resource_request.memory) + 'Mi',
+            'ephemeral-storage': str(role.resource_request.ephemeral) + 'Mi'
+        } if role.resource_request else {}
+    }
+
+
+def get_skeleton_cache_key(problem_id):
+    return 'room-manifest-skeleton-%d' % problem_id
+
+
+def invalidate_manifest_skeleton(*problem_ids):
+    cache.delete_many([get_skeleton_cache_key(problem_id) for problem_id in problem_ids])
+
+
+class RoomManifestBuilder:
+    """
+    Builds the manifest that is sent to the hub to start a run.
+
+    The parts of the manifest that are the same for all the runs of a problem are compiled into a skeleton, which is
+    cached until the problem or anything it uses changes (or for `ROOM_MANIFEST_SKELETON_TTL` seconds, since the models
+    are changed by other services too). Building a manifest then only loads the gathered submissions of the run, with
+    a single query, and the image paths of their codes are resolved from GitLab at once if they're not cached already.
+    """
+
+    def __init__(self, run, skeleton=None, gathered_submissions=None):
+        self.run = run
+        self.skeleton = skeleton
+        self.gathered_submissions = gathered_submissions
+
+    @classmethod
+    def build_many(cls, runs):
+        """Builds the manifests of runs of the same problem, loading what all of them need at once."""
+        if not runs:
+            return []
+
+        skeleton = cls.get_skeleton(runs[0].problem_id)
+        gathered_submissions = {run.id: [] for run in runs}
+        for gathered_submission in cls._select_gathered_submissions(
+            apps.get_model('problem', 'GatheredSubmission').objects.filter(run__in=runs)
+        ):
+            gathered_submissions[gathered_submission.run_id].append(gathered_submission)
+
+        if skeleton['kind'] == 'Room':
+            Code.prefetch_git_repo_paths(cls._get_codes([
+                gathered_submission for run_gathered_submissions in gathered_submissions.values()
+                for gathered_submission in run_gathered_submissions
+            ]))
+
+        return [cls(run, skeleton, gathered_submissions[run.id]).build() for run in runs]
+
+    @classmethod
+    def get_skeleton(cls, problem_id):
+        key = get_skeleton_cache_key(problem_id)
+
+        skeleton = cache.get(key)
+        if skeleton is None:
+            skeleton = cls.compile_skeleton(cls._load_problem(problem_id))
+            cache.set(key, skeleton, settings.ROOM_MANIFEST_SKELETON_TTL)
+        return skeleton
+
+    @staticmethod
+    def compile_skeleton(problem):
+        if problem.gimulator_tag is None:
+            return {'kind': 'Simple', 'problem_id': problem.id}
+
+        director_role = problem.director_role
+        director_code = problem.evaluator_codes[0] if problem.evaluator_codes else None
+
+        return {
+            'kind': 'Room',
+            'problem_id': problem.id,
+            'code_execution': problem.code_execution,
+            'actor_envs': [
+                {'name': 'DATA_%d_PATH' % data.id, 'value': '/data/' + data.pvc_name} for data in problem.datasets.all()
+            ] if problem.code_execution else None,
+            'director': {
+                'code_id': director_code.id,
+                'image': '%s/%s:%d' % (
+                    settings.DOCKER_REGISTRY_HOST,
+                    director_code.get_git_repo_path().lower(),
+                    director_code.id
+                ),
+                'resources': render_resources(director_role)
+            },
+            'timeout': problem.timeout,
+            'terminateOnActorFailure': problem.terminate_on_actor_failure
+        }
+
+    def build(self):
+        skeleton = self.skeleton or self.get_skeleton(self.run.problem_id)
+        gathered_submissions = self.gathered_submissions
+        if gathered_submissions is None:
+            gathered_submissions = self._select_gathered_submissions(self.run.gatheredsubmission_set.all())
+
+        if skeleton['kind'] == 'Simple':
+            return {
+                'run_id': self.run.id,
+                'problem-id': skeleton['problem_id'],
+                'actors': [
+                    {
+                        'id': gathered_submission.id,
+                        'submission-id': gathered_submission.submission_id
+                    } for gathered_submission in gathered_submissions
+                ]
+            }
+
+        Code.prefetch_git_repo_paths(self._get_codes(gathered_submissions))
+
+        director = skeleton['director']
+        return {
+            'apiVersion': 'hub.roboepics.com/v1',
+            'kind': 'Room',
+            'metadata': {
+                'name': 'room-%d' % self.run.id,
+                'namespace': settings.HUB_NAMESPACE
+            },
+            'spec': {
+                'id': str(self.run.id),
+                'problemID': str(skeleton['problem_id']),
+
+                'director': {
+                    'name': '-'.join((str(director['code_id']), str(self.run.id))),
+                    'image': director['image'],
+                    'resources': director['resources']
+                },
+                'actors': [
+                    {
+                        'name': str(gathered_submission.id),
+                        'image': '/'.join((
+                            settings.DOCKER_REGISTRY_HOST,
+                            gathered_submission.submission.generate_image_name()
+                        )),
+                        'role': gathered_submission.role.name if gathered_submission.role else 'agent',
+                        'envs': [
+                            {'name': 'S3_ENDPOINT_URL', 'value': settings.S3_ENDPOINT_URL.split('//')[1]},
+                            {'name': 'S3_ACCESS_KEY_ID', 'value': settings.S3_ACCESS_KEY_ID},
+                            {'name': 'S3_SECRET_ACCESS_KEY', 'value': settings.S3_SECRET_ACCESS_KEY},
+                            {'name': 'S3_RESULT_BUCKET_NAME', 'value': settings.S3_RESULT_BUCKET_NAME},
+                            {'name': 'S3_PATH_PREFIX', 'value': str(gathered_submission.submission_id) + '/'}
+                        ] if skeleton['code_execution'] is False else skeleton['actor_envs'],
+                        'resources': render_resources(gathered_submission.role)
+                    } for gathered_submission in gathered_submissions
+                ],
+                'metrico': {
+                    'enabled': True,
+                    'name': str(self.run.id),
+                    'image': 'xerac/metrico:staging'
+                },
+                'timeout': skeleton['timeout'],
+                'terminateOnActorFailure': skeleton['terminateOnActorFailure']
+            }
+        }
+
+    @staticmethod
+    def _load_problem(problem_id):
+        problem_code_model = apps.get_model('problem', 'ProblemCode')
+
+        return apps.get_model('problem', 'Problem').objects.select_related(
+            'director_role__resource_limit', 'director_role__resource_request'
+        ).prefetch_related(
+            'datasets',
+            Prefetch(
+                'problemcode_set', to_attr='evaluator_codes',
+                queryset=problem_code_model.objects.filter(kind=ProblemCodeKind.EVALUATOR).order_by('id')
+            )
+        ).get(id=problem_id)
+
+    @staticmethod
+    def _select_gathered_submissions(queryset):
+        return list(queryset.select_related(
+            'submission__problem_enter__problem', 'submission__problem_enter__code',
+            'role__resource_limit', 'role__resource_request'
+        ))
+
+    @staticmethod
+    def _get_codes(gathered_submissions):
+        """Returns the codes whose images are used by the actors of the manifest."""
+        return [
+            gathered_submission.submission.problem_enter.code for gathered_submission in gathered_submissions
+            if gathered_submission.submission.problem_enter.problem.code_execution
+        ]
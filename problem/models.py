@@ -3,6 +3,7 @@ from json import dumps as json_dump
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
 from taggit.managers import TaggableManager
@@ -10,16 +11,45 @@ from taggit.models import TagBase, GenericTaggedItemBase
 
 from .enums import *
 from .gimulator_models import GimulatorRole
+from .managers import RunManager
+from .manifests import RoomManifestBuilder
 
 from account.models import Team
 from code_metadata.models import Code
 from dataset.models import Data
+from outbox.models import publish
 
-from utils import random_path, clients
+from utils import random_path
 
 User = get_user_model()
 
 
+class StatusTransitionMixin:
+    def transition(self, status, expected=None, **fields):
+        """
+        Moves the object to `status` and sets `fields` along with it, only if its status in the database is still
+        `expected` (the status of this instance by default, or any of a list of statuses). Only those columns are written.
+
+        Returns whether the transition was made. If not, the status of the instance is refreshed from the database.
+        """
+        expected = self.status if expected is None else expected
+        queryset = type(self)._default_manager.filter(pk=self.pk)
+
+        if isinstance(expected, (list, tuple, set)):
+            updated = queryset.filter(status__in=expected).update(status=status, **fields)
+        else:
+            updated = queryset.filter(status=expected).update(status=status, **fields)
+
+        if not updated:
+            self.status = queryset.values_list('status', flat=True).first()
+            return False
+
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return True
+
+
 class ProblemCodeTag(TagBase):
     class Meta:
         verbose_name = _("Problem Code Tag")
@@ -42,6 +72,7 @@ class Problem(models.Model):
     evaluation_mode = models.PositiveSmallIntegerField(choices=EvaluationMode.choices, default=EvaluationMode.ON_AUTO)
 
     code_execution = models.BooleanField(default=False)
+    coalesce_submissions = models.BooleanField(default=False)  # Only build the latest pending submission of each team
 
     roles = models.ManyToManyField(GimulatorRole, blank=True, related_name='as_actor')
     director_role = models.ForeignKey(GimulatorRole, models.CASCADE, related_name='as_director', null=True, blank=True)
@@ -87,7 +118,7 @@ class ProblemEnter(models.Model):
     notebook_file_id = models.CharField(max_length=100, null=True, blank=True)
 
 
-class Submission(models.Model):
+class Submission(StatusTransitionMixin, models.Model):
     submitter = models.ForeignKey(User, models.CASCADE)
     problem_enter = models.ForeignKey(ProblemEnter, models.CASCADE)
 
@@ -105,17 +136,24 @@ class Submission(models.Model):
 
         IMAGE_PUSH_FAILED = 60, _("Image Push Failed")
 
+        SUPERSEDED = 70, _("Superseded")
+
         SUBMISSION_READY = 100, _("Submission Ready")
     status = models.PositiveSmallIntegerField(choices=SubmissionStatus.choices, default=SubmissionStatus.WAITING_IN_QUEUE)
 
     runs = models.ManyToManyField('Run', through='GatheredSubmission')  # A shortcut for simplicity
 
+    class Meta:
+        indexes = [models.Index(fields=('problem_enter', 'reference'), name='submission_reference_idx')]
+
     def clean(self):
         if self.problem_enter.problem.repository_mode != RepositoryMode.OFF and Submission.objects.filter(problem_enter=self.problem_enter, reference=self.reference).exclude(pk=self.pk).exists():
             raise ValidationError(_("You cannot submit with the same commit reference you have submitted before!"), code='invalid')
 
     def save(self, skip_run=False, *args, **kwargs):
-        self.clean()
+        # Only the reference of a new submission has to be checked, its status is changed with `transition`
+        if self._state.adding:
+            self.clean()
 
         problem = self.problem_enter.problem
         if not problem.code_execution:
@@ -123,18 +161,35 @@ class Submission(models.Model):
 
         super().save(*args, **kwargs)
 
-        if not skip_run and self.status == Submission.SubmissionStatus.SUBMISSION_READY and problem.evaluation_mode == EvaluationMode.ON_AUTO:
-            run = Run.objects.create(owner=self.submitter, problem=problem)
-            run.gatheredsubmission_set.create(submission=self, role=problem.roles.first())
-            run.status = Run.RunStatus.READY
-            run.save()
+        if not skip_run and self.status == Submission.SubmissionStatus.SUBMISSION_READY:
+            self.create_auto_run()
+
+    def transition(self, status, expected=None, skip_run=False, **fields):
+        if not super().transition(status, expected, **fields):
+            return False
+
+        if not skip_run and status == Submission.SubmissionStatus.SUBMISSION_READY:
+            self.create_auto_run()
+        return True
+
+    def create_auto_run(self):
+        problem = self.problem_enter.problem
+        if problem.evaluation_mode == EvaluationMode.ON_AUTO:
+            Run.objects.create_bulk(problem, self.submitter, [[(self, problem.roles.first())]])
+
+    def is_superseded(self):
+        """Whether a newer submission of the same team will be built in place of this one."""
+        return Submission.objects.filter(problem_enter_id=self.problem_enter_id, id__gt=self.id).exclude(status__in=(
+            Submission.SubmissionStatus.IMAGE_BUILD_FAILED, Submission.SubmissionStatus.IMAGE_PUSH_FAILED,
+            Submission.SubmissionStatus.SUPERSEDED
+        )).exists()
 
     def generate_image_name(self):
         problem_enter = self.problem_enter
         return settings.RESULT_ONLY_IMAGE_PATH if not problem_enter.problem.code_execution else "%s:%d" % (problem_enter.code.get_git_repo_path().lower(), self.id)
 
 
-class Run(models.Model):
+class Run(StatusTransitionMixin, models.Model):
     owner = models.ForeignKey(User, models.CASCADE)
     problem = models.ForeignKey(Problem, models.CASCADE)  # A shortcut for efficiency
 
@@ -157,104 +212,31 @@ class Run(models.Model):
 
     date_created = models.DateTimeField(auto_now_add=True)
 
+    objects = RunManager()
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
-        if self.status == self.RunStatus.READY:
-            problem = self.problem
-
-            if problem.gimulator_tag is None:
-                manifest = {
-                    'run_id': self.id,
-                    'problem-id': problem.id,
-                    'actors': [
-                        {
-                            'id': gathered_submission.id,
-                            'submission-id': gathered_submission.submission.id
-                        } for gathered_submission in self.gatheredsubmission_set.all()
-                    ]
-                }
-            else:
-                director_role = problem.director_role
-                director_code = problem.problemcode_set.filter(kind=ProblemCodeKind.EVALUATOR).first()
-
-                dataset_paths_envs = [{'name': 'DATA_%d_PATH' % data.id, 'value': '/data/' + data.pvc_name} for data in problem.datasets.all()]
-
-                manifest = {
-                    'apiVersion': 'hub.roboepics.com/v1',
-                    'kind': 'Room',
-                    'metadata': {
-                        'name': 'room-%d' % self.id,
-                        'namespace': settings.HUB_NAMESPACE
-                    },
-                    'spec': {
-                        'id': str(self.id),
-                        'problemID': str(problem.id),
-
-                        'director': {
-                            'name': '-'.join((str(director_code.id), str(self.id))),
-                            'image': '%s/%s:%d' % (
-                                settings.DOCKER_REGISTRY_HOST,
-                                director_code.get_git_repo_path().lower(),
-                                director_code.id
-                            ),
-                            'resources': {
-                                'limits': {
-                                    'cpu': str(director_role.resource_limit.cpu),
-                                    'memory': str(director_role.resource_limit.memory) + 'Mi',
-                                    'ephemeral-storage': str(director_role.resource_limit.ephemeral) + 'Mi'
-                                } if director_role.resource_limit else {},
-                                'requests': {
-                                    'cpu': str(director_role.resource_request.cpu),
-                                    'memory': str(director_role.resource_request.memory) + 'Mi',
-                                    'ephemeral-storage': str(director_role.resource_request.ephemeral) + 'Mi'
-                                } if director_role.resource_request else {}
-                            } if director_role else {}
-                        },
-                        'actors': [
-                            {
-                                'name': str(gathered_submission.id),
-                                'image': '/'.join((
-                                    settings.DOCKER_REGISTRY_HOST,
-                                    gathered_submission.submission.generate_image_name()
-                                )),
-                                'role': gathered_submission.role.name if gathered_submission.role else 'agent',
-                                'envs': [
-                                    {'name': 'S3_ENDPOINT_URL', 'value': settings.S3_ENDPOINT_URL.split('//')[1]},
-                                    {'name': 'S3_ACCESS_KEY_ID', 'value': settings.S3_ACCESS_KEY_ID},
-                                    {'name': 'S3_SECRET_ACCESS_KEY', 'value': settings.S3_SECRET_ACCESS_KEY},
-                                    {'name': 'S3_RESULT_BUCKET_NAME', 'value': settings.S3_RESULT_BUCKET_NAME},
-                                    {'name': 'S3_PATH_PREFIX', 'value': str(gathered_submission.submission_id) + '/'}
-                                ] if problem.code_execution is False else dataset_paths_envs,
-                                'resources': {
-                                    'limits': {
-                                        'cpu': str(gathered_submission.role.resource_limit.cpu),
-                                        'memory': str(gathered_submission.role.resource_limit.memory) + 'Mi',
-                                        'ephemeral-storage': str(gathered_submission.role.resource_limit.ephemeral) + 'Mi'
-                                    } if gathered_submission.role.resource_limit else {},
-                                    'requests': {
-                                        'cpu': str(gathered_submission.role.resource_request.cpu),
-                                        'memory': str(gathered_submission.role.resource_request.memory) + 'Mi',
-                                        'ephemeral-storage': str(gathered_submission.role.resource_request.ephemeral) + 'Mi'
-                                    } if gathered_submission.role.resource_request else {}
-                                } if gathered_submission.role else {}
-                            } for gathered_submission in self.gatheredsubmission_set.all()
-                        ],
-                        'metrico': {
-                            'enabled': True,
-                            'name': str(self.id),
-                            'image': 'xerac/metrico:staging'
-                        },
-                        'timeout': problem.timeout,
-                        'terminateOnActorFailure': problem.terminate_on_actor_failure
-                    }
-                }
-
-            clients.queue_client.push(json_dump(manifest), '%s-%d' % (settings.ROOM_QUEUE_NAME_PREFIX, problem.id))
-
-            self.status = self.RunStatus.POD_BUILD_JOB_ENQUEUED
+            if self.status == self.RunStatus.READY:
+                self.enqueue()
 
-            super().save(*args, **kwargs)
+    def transition(self, status, expected=None, **fields):
+        with transaction.atomic():
+            if not super().transition(status, expected, **fields):
+                return False
+
+            if status == self.RunStatus.READY:
+                self.enqueue()
+        return True
+
+    def enqueue(self):
+        """Sends the manifest of the run to the hub once the current transaction is committed."""
+        manifest = RoomManifestBuilder(self).build()
+
+        with transaction.atomic():
+            if self.transition(self.RunStatus.POD_BUILD_JOB_ENQUEUED, expected=self.RunStatus.READY):
+                publish(json_dump(manifest), '%s-%d' % (settings.ROOM_QUEUE_NAME_PREFIX, self.problem_id))
 
 
 class GatheredSubmission(models.Model):
@@ -262,3 +244,4 @@ class GatheredSubmission(models.Model):
     run = models.ForeignKey(Run, models.CASCADE)
 
     role = models.ForeignKey(GimulatorRole, models.CASCADE, null=True, blank=True)
+
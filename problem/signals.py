@@ -0,0 +1,78 @@
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .gimulator_models import GimulatorRole, Resource
+from .manifests import invalidate_manifest_skeleton
+from .models import Problem, ProblemCode
+
+from dataset.models import Data
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def invalidate_problem_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(instance.id)
+
+
+@receiver(post_save, sender=ProblemCode)
+@receiver(post_delete, sender=ProblemCode)
+def invalidate_problem_code_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(instance.problem_id)
+
+
+@receiver(m2m_changed, sender=Problem.datasets.through)
+def invalidate_datasets_manifest(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        invalidate_manifest_skeleton(instance.id)
+    elif pk_set:
+        invalidate_manifest_skeleton(*pk_set)
+    else:  # Cleared from the side of the dataset
+        invalidate_manifest_skeleton(*instance.problem_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Data)
+def invalidate_data_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(*instance.problem_set.values_list('id', flat=True))
+
+
+def get_director_problem_ids(role):
+    return list(role.as_director.values_list('id', flat=True))
+
+
+def get_resource_problem_ids(resource):
+    return list(Problem.objects.filter(
+        Q(director_role__resource_limit=resource) | Q(director_role__resource_request=resource)
+    ).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=GimulatorRole)
+def invalidate_role_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(*get_director_problem_ids(instance))
+
+
+@receiver(post_save, sender=Resource)
+def invalidate_resource_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(*get_resource_problem_ids(instance))
+
+
+# The problems of a deleted role or resource can't be looked up after it's deleted, so they're kept on it until then
+
+
+@receiver(pre_delete, sender=GimulatorRole)
+def collect_role_problems(sender, instance, **kwargs):
+    instance.manifest_problem_ids = get_director_problem_ids(instance)
+
+
+@receiver(pre_delete, sender=Resource)
+def collect_resource_problems(sender, instance, **kwargs):
+    instance.manifest_problem_ids = get_resource_problem_ids(instance)
+
+
+@receiver(post_delete, sender=GimulatorRole)
+@receiver(post_delete, sender=Resource)
+def invalidate_deleted_manifest(sender, instance, **kwargs):
+    invalidate_manifest_skeleton(*getattr(instance, 'manifest_problem_ids', ()))
@@ -0,0 +1,195 @@
+import logging
+from itertools import combinations, islice
+from math import comb, exp
+from random import Random
+from time import monotonic, sleep
+
+from django.apps import apps
+from django.conf import settings
+
+logger = logging.getLogger('runner')
+
+ROUND_ROBIN = 'round_robin'
+SWISS = 'swiss'
+RATING = 'rating'
+
+# The prior of TrueSkill, used for submissions that have no rating yet
+DEFAULT_RATING = (25., 25. / 3)
+
+
+class TournamentScheduler:
+    """
+    Makes matchups between the latest ready submissions of the teams of a multi-player problem and starts their runs.
+
+    The matchups are made in one of these modes:
+    - `ROUND_ROBIN`: every group of submissions plays once, in a random order if they don't fit in the budget.
+    - `SWISS`: one round of Swiss pairing, which puts submissions with close `scores` that haven't played each other
+      (according to `played`) in the same matchup.
+    - `RATING`: matchups are sampled to learn the most about `ratings`, which are (mu, sigma) pairs. Uncertain
+      submissions are picked more often and are put against submissions of about the same skill.
+
+    `scores`, `ratings` and `played` are keyed by submission ID. Each player of a matchup is given one of the roles of
+    the problem, rotating between the matchups so no team is stuck with the same role.
+    """
+
+    def __init__(self, problem, mode=ROUND_ROBIN, budget=None, scores=None, ratings=None, played=(), seed=None):
+        self.problem = problem
+        self.mode = mode
+        self.budget = budget
+        self.scores = scores or {}
+        self.ratings = ratings or {}
+        # Every pair of players of a matchup has played each other, whatever the number of players
+        self.played = {frozenset(pair) for group in played for pair in combinations(group, 2)}
+
+        self.random = Random(seed)
+
+    def get_submissions(self):
+        """Returns the latest ready submission of each team."""
+        submission_model = apps.get_model('problem', 'Submission')
+
+        return list(submission_model.objects.filter(
+            problem_enter__problem=self.problem, status=submission_model.SubmissionStatus.SUBMISSION_READY
+        ).order_by('problem_enter_id', '-id').distinct('problem_enter_id'))
+
+    def get_number_of_players(self, roles):
+        return self.problem.number_of_players or len(roles) or 2
+
+    def get_matchups(self):
+        """
+        Returns an iterable of the matchups as lists of (submission, role) pairs. A round robin without a budget is made
+        while it's iterated, since it can have too many matchups to keep in memory.
+        """
+        submissions = self.get_submissions()
+        roles = list(self.problem.roles.order_by('id'))
+        number_of_players = self.get_number_of_players(roles)
+
+        if len(submissions) < number_of_players:
+            logger.info("Not enough submissions to make a matchup of %d players." % number_of_players)
+            return []
+
+        if self.mode == ROUND_ROBIN:
+            groups = self._round_robin(submissions, number_of_players)
+        elif self.mode == SWISS:
+            groups = self._swiss(submissions, number_of_players)
+        elif self.mode == RATING:
+            groups = self._sample_by_rating(submissions, number_of_players)
+        else:
+            raise ValueError("Unknown tournament mode %s!" % self.mode)
+
+        return (self._assign_roles(group, roles, i) for i, group in enumerate(groups))
+
+    def schedule(self, batch_size=None, max_active_runs=None, poll_interval=None, timeout=None):
+        """
+        Creates the runs of the matchups in batches, waiting before each batch until there are no more than
+        `max_active_runs` runs of the problem waiting or running on the cluster. Gives up on the remaining batches if
+        that takes more than `timeout` seconds in total. Returns the created runs.
+        """
+        batch_size = batch_size or settings.TOURNAMENT_BATCH_SIZE
+        max_active_runs = max_active_runs or settings.TOURNAMENT_MAX_ACTIVE_RUNS
+        poll_interval = poll_interval or settings.TOURNAMENT_POLL_INTERVAL
+        timeout = timeout or settings.TOURNAMENT_SCHEDULE_TIMEOUT
+
+        run_model = apps.get_model('problem', 'Run')
+        matchups = iter(self.get_matchups())
+        logger.info("Scheduling runs for problem %d..." % self.problem.id)
+
+        deadline = monotonic() + timeout
+        runs = []
+        for batch in iter(lambda: list(islice(matchups, batch_size)), []):
+            while self._count_active_runs() + len(batch) > max(max_active_runs, len(batch)):
+                if monotonic() + poll_interval > deadline:
+                    logger.warning("Timed out scheduling runs for problem %d after creating %d runs!" % (
+                        self.problem.id, len(runs)
+                    ))
+                    return runs
+                sleep(poll_interval)
+
+            runs += run_model.objects.create_bulk(self.problem, self.problem.owner, batch)
+
+        logger.info("Scheduled %d runs for problem %d." % (len(runs), self.problem.id))
+        return runs
+
+    def _count_active_runs(self):
+        run_model = apps.get_model('problem', 'Run')
+
+        return run_model.objects.filter(
+            problem=self.problem,
+            status__gte=run_model.RunStatus.READY, status__lt=run_model.RunStatus.RUN_FAILED
+        ).exclude(status=run_model.RunStatus.POD_BUILD_FAILED).count()
+
+    def _limit(self, groups):
+        return groups if self.budget is None else groups[:self.budget]
+
+    def _round_robin(self, submissions, number_of_players):
+        total = comb(len(submissions), number_of_players)
+        if self.budget is None or total <= self.budget:
+            return combinations(submissions, number_of_players)
+
+        # A random subset keeps the sample unbiased, unlike the first ones in order
+        if total <= 2 * self.budget:
+            # Few enough to list, while sampling would keep drawing the groups it already has
+            groups = list(combinations(submissions, number_of_players))
+            self.random.shuffle(groups)
+            return groups[:self.budget]
+
+        # Too many to list, so groups are drawn until there are enough distinct ones
+        picked = {}
+        while len(picked) < self.budget:
+            picked[tuple(sorted(self.random.sample(range(len(submissions)), number_of_players)))] = None
+        return [tuple(submissions[i] for i in indices) for indices in picked]
+
+    def _swiss(self, submissions, number_of_players):
+        # Shuffle first, so the ties are broken randomly by the stable sort
+        submissions = list(submissions)
+        self.random.shuffle(submissions)
+        submissions.sort(key=lambda submission: -self.scores.get(submission.id, 0))
+
+        groups = []
+        unpaired = submissions
+        while len(unpaired) >= number_of_players:
+            group = [unpaired[0]]
+            for avoid_rematches in (True, False):
+                for submission in unpaired[1:]:
+                    if len(group) == number_of_players:
+                        break
+                    if submission in group:
+                        continue
+                    if avoid_rematches and any(frozenset((submission.id, other.id)) in self.played for other in group):
+                        continue
+                    group.append(submission)
+
+            groups.append(tuple(group))
+            unpaired = [submission for submission in unpaired if submission not in group]
+
+        return self._limit(groups)
+
+    def _sample_by_rating(self, submissions, number_of_players):
+        ratings = {submission.id: self.ratings.get(submission.id, DEFAULT_RATING) for submission in submissions}
+
+        groups = []
+        for _ in range(self.budget if self.budget is not None else len(submissions)):
+            # The more uncertain a rating, the more a game of it teaches
+            group = self.random.choices(submissions, weights=[ratings[s.id][1] ** 2 for s in submissions])
+            mu, sigma = ratings[group[0].id]
+
+            candidates = [submission for submission in submissions if submission is not group[0]]
+            while len(group) < number_of_players:
+                # A game between players of about the same skill is the most informative
+                weights = [
+                    exp(-(ratings[s.id][0] - mu) ** 2 / (2 * (sigma ** 2 + ratings[s.id][1] ** 2))) + 1e-9
+                    for s in candidates
+                ]
+                opponent = self.random.choices(candidates, weights=weights)[0]
+                group.append(opponent)
+                candidates.remove(opponent)
+
+            groups.append(tuple(group))
+
+        return groups
+
+    @staticmethod
+    def _assign_roles(group, roles, rotation):
+        if not roles:
+            return [(submission, None) for submission in group]
+
+        return [(submission, roles[(i + rotation) % len(roles)]) for i, submission in enumerate(group)]
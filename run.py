@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
+import asyncio
 import os
 import logging
-from subprocess import Popen, PIPE
-from json import loads
+from contextlib import chdir
+from subprocess import Popen, PIPE, DEVNULL
+from tempfile import TemporaryDirectory
+from json import dumps, loads
+from threading import Thread
 from repo2docker.app import Repo2Docker
 from repo2docker.buildpacks import (
     DockerBuildPack,
@@ -22,13 +26,26 @@ import django
 django.setup()
 
 from django.conf import settings
+from django.db import connections
 from django.utils.module_loading import import_string
 
+from outbox.models import publish
+from outbox.relay import ChannelPool, OutboxRelay
 from problem.models import Submission, ProblemCode
 # from leaderboard.models import SimpleLeaderboard
 
 from buildpacks import *
 from buildpacks import stdin as stdin_buildpacks
+from builder import FairShareScheduler, PoolConsumer, ScheduledPoolConsumer, WorkerPool, WorkerCrashedError
+from builder.aio import AsyncConsumer, run_consumers, run_streamed
+from builder.buildkit import BuildError, build_with_buildkit
+from builder.cache import BuildCache, hash_build_recipe
+from builder.checkout import checkout_repository, get_tree_hash
+from builder.metrics import BuildTimings, record_build_timings, start_metrics_server
+from builder.mirror import GitMirrorCache
+from builder.push import RegistryPusher
+from builder.registry import parse_image_name
+from builder.wheelhouse import Wheelhouse
 
 buildpacks = [
     DockerBuildPack,
@@ -55,35 +72,186 @@ buildpacks = [
     CPPBuildPack
 ]
 
-# Initialize message queue client
-client = import_string(settings.QUEUE_CLIENT)(settings.QUEUE_SERVER_API_URL)
 
+def create_queue_client():
+    return import_string(settings.QUEUE_CLIENT)(settings.QUEUE_SERVER_API_URL)
+
+
+# Initialize message queue client, which only builds without a pool use (the pool consumers have their own connections)
+client = create_queue_client() if settings.BUILDER_RUNTIME != 'asyncio' and settings.BUILDER_WORKERS <= 0 else None
+
+# The event loop of the asyncio runtime and its process, where pushes are run as awaited subprocesses
+event_loop = event_loop_pid = None
+
+# The build arguments repo2docker builds with, for the user the images run as
+BUILD_ARGS = {'NB_USER': 'jovyan', 'NB_UID': '2000'}
+
+# Images only exist on the Docker daemon of the host that built them, so each host has its own push queue. It's named
+# after the host rather than the builder, so the images handed off before a restart of the builder are still pushed.
+push_queue_name = '-'.join((
+    settings.SUBMISSION_PUSHER_QUEUE_NAME, settings.BUILDER_NODE_NAME
+)) if settings.BUILDER_PUSH_WORKERS > 0 else None
 
-def create_docker_image(gitlab_repo, commit_hash, image_name, buildpack=None):
-    # Create Docker image from git repository using jupyter-repo2docker
-    r2d = Repo2Docker()
+build_cache = BuildCache(
+    settings.DOCKER_CONFIG_DIR, settings.DOCKER_REGISTRY_SCHEME
+) if settings.BUILDER_CACHE_ENABLED else None
+registry_pusher = RegistryPusher(
+    settings.DOCKER_CONFIG_DIR, settings.REGISTRY_LAYER_CACHE_DIR, settings.REGISTRY_PUSH_LAYER_WORKERS,
+    settings.REGISTRY_PUSH_RETRIES, settings.DOCKER_REGISTRY_SCHEME
+) if settings.REGISTRY_PUSH_BACKEND == 'api' else None
+wheelhouse = Wheelhouse(settings.BUILDER_WHEELHOUSE_DIR) if settings.BUILDER_WHEELHOUSE_DIR else None
+PythonBuildPack.wheelhouse_url = settings.BUILDER_WHEELHOUSE_URL if wheelhouse is not None else None
+JavaNoBuildToolBuildPack.cds_enabled = settings.BUILDER_JAVA_CDS
+mirror_cache = GitMirrorCache(settings.BUILDER_MIRROR_DIR, settings.BUILDER_MIRROR_MAX_SIZE) if settings.BUILDER_MIRROR_DIR else None
 
-    r2d.log_level = 'INFO'
-    r2d.repo = f"https://oauth2:{settings.GIT_ADMIN_TOKEN}@{settings.GIT_HOST}/{gitlab_repo}.git"
-    r2d.ref = commit_hash
-    r2d.output_image_spec = image_name
-    r2d.user_id = 2000
-    r2d.user_name = 'jovyan'
-    if buildpack is None:
-        r2d.buildpacks = buildpacks
-        r2d.default_buildpack = PythonBuildPack
-    else:
-        r2d.buildpacks = []
-        r2d.default_buildpack = buildpack
 
-    r2d.initialize()
-    r2d.build()
+def pick_buildpack(buildpack=None):
+    """Detects the buildpack of the repository in the current directory, the same way repo2docker would."""
+    if buildpack is not None:
+        return buildpack
+
+    for bp in buildpacks:
+        if bp().detect():
+            return bp
+
+    return PythonBuildPack
+
+
+def create_docker_image(code, commit_hash, image_name, buildpack=None, runtime=None, cache_from=None, timings=None):
+    """
+    Creates Docker image from git repository using jupyter-repo2docker.
+
+    Layers of the images in `cache_from` are reused when they match, pulling them from the registry if needed.
+
+    Returns the build cache key of the image and whether the image was taken from the build cache instead of being built.
+    """
+    timings = timings or BuildTimings('build')
+
+    with TemporaryDirectory(prefix='packman-') as checkout_path:
+        with timings.phase('gitlab_lookup'):
+            repo_url = code.get_git_repo_url()
+
+        with timings.phase('clone'):
+            if mirror_cache is None:
+                checkout_repository(repo_url, commit_hash, checkout_path)
+            else:
+                mirror_cache.checkout(code.project_id, repo_url, commit_hash, checkout_path)
+
+        with timings.phase('detect'), chdir(checkout_path):
+            buildpack = pick_buildpack(buildpack)
+        timings.labels['buildpack'] = buildpack.__name__
+
+        with timings.phase('cache_lookup'):
+            with chdir(checkout_path):
+                recipe_hash = hash_build_recipe(buildpack(), BUILD_ARGS)
+            cache_key = BuildCache.key(get_tree_hash(checkout_path), buildpack, runtime, recipe_hash)
+            if build_cache is not None and build_cache.restore(cache_key, image_name):
+                return cache_key, True
+
+        class TimedBuildPack(buildpack):
+            def render(self, *args, **kwargs):
+                with timings.phase('render'):
+                    return super().render(*args, **kwargs)
+
+        built = False
+        if settings.BUILDER_ENGINE == 'buildkit':
+            try:
+                with timings.phase('build'), chdir(checkout_path):
+                    build_image_with_buildkit(TimedBuildPack(), image_name, cache_from)
+                built = True
+            except BuildError:
+                # The repository doesn't build, which repo2docker can't change
+                raise
+            except Exception as e:
+                capture_exception(e)
+                logger.warning("BuildKit build of %s failed (%s), building with repo2docker..." % (image_name, str(e)))
+
+        if not built:
+            r2d = Repo2Docker()
+
+            r2d.log_level = 'INFO'
+            r2d.repo = checkout_path
+            r2d.repo_type = 'local'
+            r2d.output_image_spec = image_name
+            r2d.user_id = int(BUILD_ARGS['NB_UID'])
+            r2d.user_name = BUILD_ARGS['NB_USER']
+
+            # The buildpack is already picked, so there's no need for repo2docker to detect it again
+            r2d.buildpacks = []
+            r2d.default_buildpack = TimedBuildPack
+
+            if cache_from:
+                with timings.phase('cache_pull'):
+                    r2d.cache_from = pull_cache_images(cache_from)
+
+            r2d.initialize()
+            with timings.phase('build'):
+                r2d.build()
+
+        add_to_wheelhouse(buildpack, checkout_path, image_name, timings)
 
     # run_command = r2d.picked_buildpack.get_command()
     # run_command = None
 
     # return run_command
 
+    return cache_key, False
+
+
+def build_image_with_buildkit(buildpack, image_name, cache_from=None):
+    """
+    Builds the repository in the current directory with BuildKit, with the same build arguments as repo2docker. Its
+    cache is exported to and imported from a tag of the image's repository, next to the images in `cache_from`.
+    """
+    cache_ref = None
+    if settings.BUILDER_BUILDKIT_CACHE_TAG:
+        host, repository, _ = parse_image_name(image_name)
+        cache_ref = '%s/%s:%s' % (host, repository, settings.BUILDER_BUILDKIT_CACHE_TAG)
+
+    build_with_buildkit(buildpack, image_name, BUILD_ARGS, settings.DOCKER_CONFIG_DIR, cache_ref, cache_from or ())
+
+
+def add_to_wheelhouse(buildpack, checkout_path, image_name, timings):
+    """Builds the wheels of the requirements of a Python image into the wheelhouse, if it doesn't have them yet."""
+    if wheelhouse is None or not issubclass(buildpack, PythonBuildPack):
+        return
+
+    with chdir(checkout_path):
+        bp = buildpack()
+        requirements_path = bp.binder_path('requirements.txt')
+        if not os.path.exists(requirements_path):
+            return
+        with open(requirements_path) as f:
+            requirements = f.read()
+        python_version = bp.python_version
+
+    if wheelhouse.has(requirements, python_version):
+        return
+
+    try:
+        with timings.phase('wheelhouse'):
+            wheelhouse.populate(requirements, python_version, settings.DOCKER_CONFIG_DIR)
+    except Exception as e:
+        # The wheelhouse only speeds up later builds, so this build is fine anyway
+        capture_exception(e)
+        logger.warning("Could not add the wheels of %s to the wheelhouse: %s" % (image_name, str(e)))
+
+
+def pull_cache_images(image_names):
+    """
+    Makes sure the images to take cached layers from are present on this host, which may have never built them.
+    Returns the ones that are available.
+    """
+    available = []
+    for image_name in image_names:
+        if Popen(('docker', 'image', 'inspect', image_name), stdout=DEVNULL, stderr=DEVNULL).wait() == 0:
+            available.append(image_name)
+        elif Popen(('docker', '--config', settings.DOCKER_CONFIG_DIR, 'pull', image_name), stdout=DEVNULL, stderr=DEVNULL).wait() == 0:
+            available.append(image_name)
+        else:
+            logger.info("Could not pull %s to use as build cache, skipping it..." % image_name)
+    return available
+
 
 def push_image_to_registry(image_name):
     # password = Popen(('cat', settings.DOCKER_REGISTRY_PASSWORD_FILE), stdout=PIPE)
@@ -93,124 +261,300 @@ def push_image_to_registry(image_name):
     # if Popen(('docker', 'login', '--username', settings.DOCKER_REGISTRY_USERNAME, '--password-stdin', settings.DOCKER_REGISTRY_HOST), stdin=password.stdout, stdout=PIPE, stderr=PIPE).wait() != 0:
     #     raise ChildProcessError("Docker login failed!")
 
-    if Popen(('docker', '--config', '/data/docker', 'push', image_name), stdout=PIPE, stderr=PIPE).wait() != 0:
+    if registry_pusher is not None:
+        try:
+            report = registry_pusher.push(image_name)
+        except Exception:
+            capture_exception()
+            logger.error("Could not push Docker image %s through the registry API, falling back to docker push..." % image_name)
+        else:
+            return report
+
+    command = ('docker', '--config', settings.DOCKER_CONFIG_DIR, 'push', image_name)
+    if event_loop is not None and event_loop_pid == os.getpid():
+        # Stream the output of the push to the logs, without blocking the loop that talks to the broker
+        exit_code = asyncio.run_coroutine_threadsafe(run_streamed(*command), event_loop).result()
+    else:
+        exit_code = Popen(command, stdout=PIPE, stderr=PIPE).wait()
+
+    if exit_code != 0:
         raise ChildProcessError("Docker push failed!")
 
 
-def handle_new_message(channel, method_frame, header_frame, result):
-    logger.info("Received a new message from queue...")
+def store_in_build_cache(cache_key, image_name):
+    if build_cache is None or cache_key is None:
+        return
 
-    request = loads(result)
+    try:
+        build_cache.store(cache_key, image_name)
+    except Exception:
+        # A missing cache entry only costs a rebuild later, so it shouldn't fail the build
+        capture_exception()
+        logger.error("Could not store Docker image %s in the build cache!" % image_name)
+
+
+def push_code_image(code_id, image_name, cache_key, timings):
+    try:
+        with timings.phase('push'):
+            timings.set_push_report(push_image_to_registry(image_name))
+        with timings.phase('cache_store'):
+            store_in_build_cache(cache_key, image_name)
+        timings.outcome = 'pushed'
+
+        logger.debug("Successfully pushed Docker image for ProblemCode %d!" % code_id)
+    except ChildProcessError as e:
+        capture_exception()
+        timings.outcome = 'push_failed'
+
+        logger.error("Something went wrong while pushing Docker image for ProblemCode %d: %s!" % (code_id, str(e)))
+
+
+def transition_submission(submission, status, **kwargs):
+    """
+    Moves the submission to `status` unless its status has been changed by someone else since it was read, like an
+    admin or another builder, in which case it's left as it is. Returns whether the submission was moved.
+    """
+    if submission.transition(status, **kwargs):
+        return True
+
+    logger.warning("Submission %d has been moved to status %s in the meantime, leaving it there." % (
+        submission.id, submission.get_status_display()
+    ))
+    return False
+
+
+def push_submission_image(submission, image_name, cache_key, timings):
+    # Push the image to Docker registry
+    logger.info("Pushing Docker image for submission...")
+    try:
+        with timings.phase('push'):
+            timings.set_push_report(push_image_to_registry(image_name))
+        with timings.phase('cache_store'):
+            store_in_build_cache(cache_key, image_name)
+        timings.outcome = 'pushed'
+
+        if transition_submission(submission, Submission.SubmissionStatus.SUBMISSION_READY):
+            logger.info("Successfully pushed Docker image for submission!")
+    except ChildProcessError as e:
+        capture_exception()
+        timings.outcome = 'push_failed'
+
+        transition_submission(submission, Submission.SubmissionStatus.IMAGE_PUSH_FAILED)
+
+        logger.error("Something went wrong while pushing Docker image for submission: %s!" % str(e))
+
+
+def hand_off_push(request, timings):
+    """Enqueues the push of an image built on this host for the push stage."""
+    publish(dumps({**request, 'buildpack': timings.labels['buildpack']}), push_queue_name)
+    timings.outcome = 'handed_off'
+
+    logger.info("Handed off Docker image %s to the push stage." % request['image_name'])
+
+
+def process_push_message(result):
+    """
+    Pushes the image that the build stage has handed off. Acking the message is left to the caller.
+
+    Returns the timings of the push.
+    """
+    timings = BuildTimings('push')
+    try:
+        push_handed_off_image(result, timings)
+    finally:
+        timings.finish()
+    return timings
+
+
+def push_handed_off_image(result, timings):
+    with timings.phase('decode'):
+        request = loads(result)
+    logger.debug("Push message content: %s" % str(request))
+    timings.labels['buildpack'] = request.get('buildpack', 'unknown')
+
+    if 'code_id' in request:
+        timings.labels['id'] = 'code:%d' % request['code_id']
+        push_code_image(request['code_id'], request['image_name'], request['cache_key'], timings)
+        return
+
+    timings.labels['id'] = 'submission:%d' % request['submission_id']
+    try:
+        with timings.phase('db_fetch'):
+            submission = Submission.objects.select_related('problem_enter').get(id=request['submission_id'])
+            timings.labels['problem'] = str(submission.problem_enter.problem_id)
+    except Submission.DoesNotExist:
+        capture_exception()
+
+        logger.error("No submission with ID %s exists! Dropping push message from queue..." % request['submission_id'])
+
+        return
+
+    if submission.status != Submission.SubmissionStatus.IMAGE_BUILD_SUCCESSFUL:
+        logger.info("Submission %d is in status %s, so there's nothing to push." % (submission.id, submission.get_status_display()))
+        timings.outcome = 'skipped'
+        return
+
+    push_submission_image(submission, request['image_name'], request['cache_key'], timings)
+
+
+def start_push_stage():
+    logger.info('Waiting on messages from push queue "%s"...' % push_queue_name)
+
+    PoolConsumer(
+        settings.QUEUE_SERVER_API_URL, push_queue_name, WorkerPool(settings.BUILDER_PUSH_WORKERS, isolated=False, name='pusher'),
+        process_push_message, on_result=record_build_timings
+    ).start()
+
+
+def process_message(result):
+    """
+    Builds and pushes the image of the submission or problem code that the message asks for.
+
+    Acking the message is left to the caller. Returns the timings of the build.
+    """
+    timings = BuildTimings('build')
+    try:
+        build_requested_image(result, timings)
+    finally:
+        timings.finish()
+    return timings
+
+
+def build_requested_image(result, timings):
+    with timings.phase('decode'):
+        request = loads(result)
     logger.debug("Message content: %s" % str(request))
 
     if 'code_id' in request:  # FIXME
-        code = ProblemCode.objects.get(id=request['code_id'])
-        image_name = "%s/%s:%d" % (settings.DOCKER_REGISTRY_HOST, code.get_git_repo_path().lower(), code.id)
+        timings.labels['id'] = 'code:%d' % request['code_id']
+        with timings.phase('db_fetch'):
+            code = ProblemCode.objects.get(id=request['code_id'])
+        timings.labels['problem'] = str(code.problem_id)
+
+        with timings.phase('gitlab_lookup'):
+            image_name = "%s/%s:%d" % (settings.DOCKER_REGISTRY_HOST, code.get_git_repo_path().lower(), code.id)
 
         try:
-            create_docker_image(code.get_git_repo_path(), request['reference'], image_name)
+            # The previous image of the same code is the closest one to the new build
+            cache_key, reused = create_docker_image(
+                code, request['reference'], image_name, cache_from=[image_name], timings=timings
+            )
 
             logger.debug("Successfully created Docker image for ProblemCode %d!" % code.id)
         except Exception:
             capture_exception()
             logger.error("Something went wrong while building Docker image for ProblemCode %d!" % code.id)
-
-            client.ack(method_frame.delivery_tag)
+            timings.outcome = 'build_failed'
 
             return
 
-        try:
-            push_image_to_registry(image_name)
-
-            logger.debug("Successfully pushed Docker image for ProblemCode %d!" % code.id)
-        except ChildProcessError as e:
-            capture_exception()
+        if reused:
+            timings.outcome = 'reused'
+            return
 
-            logger.error("Something went wrong while pushing Docker image for ProblemCode %d: %s!" % (code.id, str(e)))
+        if push_queue_name is not None:
+            hand_off_push({'code_id': code.id, 'image_name': image_name, 'cache_key': cache_key}, timings)
+        else:
+            push_code_image(code.id, image_name, cache_key, timings)
 
-        client.ack(method_frame.delivery_tag)
         return
 
+    timings.labels['id'] = 'submission:%s' % request['submission_id']
     try:
-        submission = Submission.objects.get(id=request['submission_id'])
+        with timings.phase('db_fetch'):
+            submission = Submission.objects.select_related(
+                'problem_enter__team', 'problem_enter__problem', 'problem_enter__code'
+            ).get(id=request['submission_id'])
     except Submission.DoesNotExist:
         capture_exception()
 
         logger.error("No submission with ID %s exists! Dropping message from queue..." % request['submission_id'])
 
-        client.ack(method_frame.delivery_tag)
         return
 
     enter = submission.problem_enter
+    timings.labels['problem'] = str(enter.problem_id)
 
     logger.info('Processing submission of "%s" with ID %d and status %s...' % (enter.team.name, submission.id, submission.get_status_display()))
 
-    if submission.status == Submission.SubmissionStatus.WAITING_IN_QUEUE:
-        logger.info("Submission is eligible for build.")
-
-        submission.status = Submission.SubmissionStatus.IMAGE_BUILD_JOB_ENQUEUED
-        submission.save()
+    if submission.status == Submission.SubmissionStatus.WAITING_IN_QUEUE and enter.problem.coalesce_submissions:
+        with timings.phase('db_fetch'):
+            superseded = submission.is_superseded() and submission.transition(Submission.SubmissionStatus.SUPERSEDED)
+        if superseded:
+            logger.info("Skipping submission since a newer one of the same team is going to be built...")
+            timings.outcome = 'superseded'
+            return
 
-    if submission.status == Submission.SubmissionStatus.IMAGE_BUILD_JOB_ENQUEUED:
-        logger.info("Starting to build submission...")
+    waiting_statuses = (Submission.SubmissionStatus.WAITING_IN_QUEUE, Submission.SubmissionStatus.IMAGE_BUILD_JOB_ENQUEUED)
+    if submission.status in waiting_statuses:
+        logger.info("Submission is eligible for build. Starting to build submission...")
 
-        submission.status = Submission.SubmissionStatus.IMAGE_BUILD_STARTED
-        submission.save()
+        if not submission.transition(Submission.SubmissionStatus.IMAGE_BUILD_STARTED, expected=waiting_statuses):
+            logger.info("Submission has been picked up by another builder and is now in status %s." % submission.get_status_display())
+            timings.outcome = 'skipped'
+            return
+    elif submission.status == Submission.SubmissionStatus.IMAGE_BUILD_STARTED:
+        # Like a message the broker delivers again after another builder lost its connection in the middle of the build
+        logger.info("Skipping submission since it's already being built...")
+        timings.outcome = 'skipped'
+        return
 
-    image_name = '/'.join((settings.DOCKER_REGISTRY_HOST, submission.generate_image_name()))
+    cache_key = None
+    with timings.phase('gitlab_lookup'):
+        image_name = '/'.join((settings.DOCKER_REGISTRY_HOST, submission.generate_image_name()))
     if submission.status == Submission.SubmissionStatus.IMAGE_BUILD_STARTED:
         # Create Docker image from Gitlab repository
         logger.info('Creating Docker image...')
 
-        submission.status = Submission.SubmissionStatus.IMAGE_BUILD_STARTED
-        submission.save()
-
         buildpack = None  # TODO this code was written in a rush for a specific competition. needs cleaning.
         if submission.runtime:
             logger.info("Submission has runtime " + submission.get_runtime_display())
             if submission.runtime == "other":
-                submission.status = Submission.SubmissionStatus.SUBMISSION_READY
-                submission.save(skip_run=True)
+                transition_submission(submission, Submission.SubmissionStatus.SUBMISSION_READY, skip_run=True)
                 logger.info("Skipping submission due to unsupported runtime...")
+                timings.outcome = 'skipped'
                 return
             buildpack = getattr(stdin_buildpacks, submission.runtime, None)
 
+        # The team's latest image most probably has the same dependencies as this one
+        with timings.phase('db_fetch'):
+            previous_submission_id = Submission.objects.filter(
+                problem_enter=enter, status=Submission.SubmissionStatus.SUBMISSION_READY
+            ).exclude(id=submission.id).order_by('-id').values_list('id', flat=True).first()
+        cache_from = ['%s:%d' % (image_name.rpartition(':')[0], previous_submission_id)] if previous_submission_id else []
+
         try:
-            create_docker_image(enter.code.get_git_repo_path(), submission.reference, image_name, buildpack)
+            cache_key, reused = create_docker_image(
+                enter.code, submission.reference, image_name, buildpack, submission.runtime, cache_from, timings
+            )
         except Exception:
             capture_exception()
             logger.error("Something went wrong while building Docker image for submission!")
+            timings.outcome = 'build_failed'
 
-            submission.status = Submission.SubmissionStatus.IMAGE_BUILD_FAILED
-            submission.save()
-
-            client.ack(method_frame.delivery_tag)
+            transition_submission(submission, Submission.SubmissionStatus.IMAGE_BUILD_FAILED)
 
             return
 
-        submission.status = Submission.SubmissionStatus.IMAGE_BUILD_SUCCESSFUL
-        # submission.command = ' '.join(run_command)
-        submission.save()
+        if reused:
+            # The same content is already built and pushed before, and now it's tagged with this submission's name
+            timings.outcome = 'reused'
+            if transition_submission(submission, Submission.SubmissionStatus.SUBMISSION_READY):
+                logger.info("Reused a previously built Docker image for submission!")
+        else:
+            # submission.command = ' '.join(run_command)
+            if not transition_submission(submission, Submission.SubmissionStatus.IMAGE_BUILD_SUCCESSFUL):
+                timings.outcome = 'skipped'
+                return
 
-        logger.info("Successfully created Docker image for submission!")
+            logger.info("Successfully created Docker image for submission!")
 
     if submission.status == Submission.SubmissionStatus.IMAGE_BUILD_SUCCESSFUL:
-        # Push the image to Docker registry
-        logger.info("Pushing Docker image for submission...")
-        try:
-            push_image_to_registry(image_name)
-
-            submission.status = Submission.SubmissionStatus.SUBMISSION_READY
-            submission.save()
-
-            logger.info("Successfully pushed Docker image for submission!")
-        except ChildProcessError as e:
-            capture_exception()
-
-            submission.status = Submission.SubmissionStatus.IMAGE_PUSH_FAILED
-            submission.save()
-
-            logger.error("Something went wrong while pushing Docker image for submission: %s!" % str(e))
+        if push_queue_name is not None:
+            # Let the push stage upload the image, so the next build can start right away
+            hand_off_push({'submission_id': submission.id, 'image_name': image_name, 'cache_key': cache_key}, timings)
+        else:
+            push_submission_image(submission, image_name, cache_key, timings)
 
     # Reset operator's rating for this problem, FIXME it's better to be in a post_save signal
     # Leaderboard.objects.get(
@@ -226,11 +570,138 @@ def handle_new_message(channel, method_frame, header_frame, result):
     #     owner_id=submission.owner_id
     # )
 
-    logger.info("Build process is finished! Sending an ack...")
+    logger.info("Build process is finished!")
+
+
+def handle_new_message(channel, method_frame, header_frame, result):
+    logger.info("Received a new message from queue...")
+
+    record_build_timings(process_message(result))
+
+    logger.info("Sending an ack...")
     client.ack(method_frame.delivery_tag)
     logger.info("Ack sent!")
 
 
-if __name__ == "__main__":
+def classify_message(result):
+    """
+    Returns the team and problem of a build message and whether it should skip the fair-share queue.
+
+    Problem codes, and the first submission of a team to a problem, are small in number and someone is usually waiting
+    on them, so they're given priority.
+    """
+    request = loads(result)
+    try:
+        if 'code_id' in request:
+            problem_id = ProblemCode.objects.filter(id=request['code_id']).values_list('problem_id', flat=True).first()
+            return None, problem_id, True
+
+        enter = Submission.objects.filter(id=request['submission_id']).values_list(
+            'problem_enter_id', 'problem_enter__team_id', 'problem_enter__problem_id'
+        ).first()
+        if enter is None:  # Let the build drop it
+            return None, None, True
+
+        enter_id, team_id, problem_id = enter
+        is_first = not Submission.objects.filter(problem_enter_id=enter_id, id__lt=request['submission_id']).exists()
+        return team_id, problem_id, is_first
+    finally:
+        # Same as in `handle_failed_message`, forked workers must not inherit the connection of the consumer thread
+        connections.close_all()
+
+
+def get_submission_key(result):
+    """Redelivered messages of a submission that is already being built are dropped by this key."""
+    return loads(result).get('submission_id')
+
+
+def run_blocking_runtime():
+    """Runs the build stage, and the push stage if it's enabled, on the blocking queue client."""
+    if push_queue_name is not None:
+        Thread(target=start_push_stage, name='push-stage', daemon=True).start()
+
     logger.info('Waiting on messages from queue "%s"...' % settings.SUBMISSION_BUILDER_QUEUE_NAME)
-    client.pull(handle_new_message, settings.SUBMISSION_BUILDER_QUEUE_NAME)
+    if settings.BUILDER_WORKERS > 0:
+        logger.info("Building with a pool of %d workers..." % settings.BUILDER_WORKERS)
+
+        pool = WorkerPool(settings.BUILDER_WORKERS)
+        if settings.BUILDER_SCHEDULING:
+            consumer = ScheduledPoolConsumer(
+                settings.QUEUE_SERVER_API_URL, settings.SUBMISSION_BUILDER_QUEUE_NAME, pool, process_message,
+                FairShareScheduler(settings.BUILDER_TEAM_CONCURRENCY, settings.BUILDER_PROBLEM_WEIGHTS),
+                classify_message, settings.BUILDER_SCHEDULER_WINDOW,
+                on_result=record_build_timings, on_error=handle_failed_message, dedupe_key=get_submission_key
+            )
+        else:
+            consumer = PoolConsumer(
+                settings.QUEUE_SERVER_API_URL, settings.SUBMISSION_BUILDER_QUEUE_NAME, pool, process_message,
+                on_result=record_build_timings, on_error=handle_failed_message, dedupe_key=get_submission_key
+            )
+        consumer.start()
+    else:
+        client.pull(handle_new_message, settings.SUBMISSION_BUILDER_QUEUE_NAME)
+
+
+async def run_async_runtime():
+    """Runs the build stage, and the push stage if it's enabled, on an asyncio event loop until SIGTERM."""
+    global event_loop, event_loop_pid
+    event_loop, event_loop_pid = asyncio.get_running_loop(), os.getpid()
+
+    workers = max(settings.BUILDER_WORKERS, 1)
+    logger.info("Building with a pool of %d workers on the asyncio runtime..." % workers)
+
+    consumers = [AsyncConsumer(
+        settings.QUEUE_SERVER_API_URL, settings.SUBMISSION_BUILDER_QUEUE_NAME, process_message, workers,
+        pool=WorkerPool(workers), on_result=record_build_timings, on_error=handle_failed_message,
+        dedupe_key=get_submission_key
+    )]
+    if push_queue_name is not None:
+        consumers.append(AsyncConsumer(
+            settings.QUEUE_SERVER_API_URL, push_queue_name, process_push_message, settings.BUILDER_PUSH_WORKERS,
+            pool=WorkerPool(settings.BUILDER_PUSH_WORKERS, isolated=False, name='pusher'),
+            on_result=record_build_timings
+        ))
+
+    await run_consumers(*consumers)
+
+
+def handle_failed_message(result, exception):
+    """
+    Marks the submission of a message whose worker died in the middle of the build as failed, so it doesn't stay in
+    the "build started" status forever.
+    """
+    if not isinstance(exception, WorkerCrashedError):
+        return
+
+    request = loads(result)
+    if 'submission_id' not in request:
+        return
+
+    try:
+        Submission.objects.filter(
+            id=request['submission_id'], status=Submission.SubmissionStatus.IMAGE_BUILD_STARTED
+        ).update(status=Submission.SubmissionStatus.IMAGE_BUILD_FAILED)
+    finally:
+        # Worker processes are forked from this thread, so they must not inherit its database connection.
+        connections.close_all()
+
+
+if __name__ == "__main__":
+    if settings.BUILDER_METRICS_PORT:
+        start_metrics_server(settings.BUILDER_METRICS_PORT)
+
+    if wheelhouse is not None:
+        wheelhouse.serve(settings.BUILDER_WHEELHOUSE_HOST, settings.BUILDER_WHEELHOUSE_PORT)
+
+    if settings.OUTBOX_EMBEDDED_RELAY:
+        OutboxRelay(
+            ChannelPool(settings.QUEUE_SERVER_API_URL, settings.OUTBOX_RELAY_WORKERS),
+            settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_POLL_INTERVAL, settings.OUTBOX_MAX_ATTEMPTS
+        ).start(settings.OUTBOX_RELAY_WORKERS)
+
+    if settings.BUILDER_RUNTIME == 'asyncio':
+        if settings.BUILDER_SCHEDULING:
+            raise SystemExit("builder.scheduling is only supported by the blocking runtime!")
+        asyncio.run(run_async_runtime())
+    else:
+        run_blocking_runtime()